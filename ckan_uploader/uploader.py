@@ -18,9 +18,11 @@ class RDFLoader(object):
     a simpler representation.
      Args:
             filename: filename of the RDF file
+            pred_res: predicate resolver to use, defaults to the
+                      resolver shared by the process
     """
-    def __init__(self, rdf_path):
-        self.conv = RDFtoHTMLConverter()
+    def __init__(self, rdf_path, pred_res=None):
+        self.conv = RDFtoHTMLConverter(pred_res=pred_res)
         self.conv.skip_links = True
         self.conv.load_file(rdf_path)
         self.nodes = self.conv.get_nodes('en')
@@ -0,0 +1,138 @@
+"""
+Compare the peak memory and time of loading a catalog through an rdflib
+Graph, the way the converter used to, with the streaming ingest in
+rdfconv.ingest. Each method is run in a separate process, which also
+reports the memory used by the resulting RdfObjects and their terms.
+
+Usage: python benchmark_ingest.py [NUMBER_OF_DATASETS]
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+
+import rdflib
+
+from rdfconv.ingest import parse_file
+from rdfconv.objects import RdfObject
+
+HEADER = '''<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+         xmlns:dcat="http://www.w3.org/ns/dcat#"
+         xmlns:dct="http://purl.org/dc/terms/"
+         xmlns:foaf="http://xmlns.com/foaf/0.1/">
+  <dcat:Catalog rdf:about="http://example.org/catalog">
+    <dct:title xml:lang="en">Catalog</dct:title>
+'''
+
+DATASET = '''    <dcat:dataset>
+      <dcat:Dataset rdf:about="http://example.org/dataset/%(i)d">
+        <dct:title xml:lang="en">Dataset %(i)d</dct:title>
+        <dct:title xml:lang="sv">Datam\xc3\xa4ngd %(i)d</dct:title>
+        <dct:description xml:lang="en">Description of dataset %(i)d, see http://example.org/about/%(i)d for more</dct:description>
+        <dct:description xml:lang="sv">Beskrivning av datam\xc3\xa4ngd %(i)d</dct:description>
+        <dct:publisher rdf:resource="http://example.org/publisher"/>
+        <dcat:keyword xml:lang="en">keyword %(k)d</dcat:keyword>
+        <dcat:distribution>
+          <dcat:Distribution>
+            <dct:title xml:lang="en">CSV of dataset %(i)d</dct:title>
+            <dcat:accessURL rdf:resource="http://example.org/dataset/%(i)d.csv"/>
+            <dct:format>text/csv</dct:format>
+          </dcat:Distribution>
+        </dcat:distribution>
+      </dcat:Dataset>
+    </dcat:dataset>
+'''
+
+FOOTER = '''  </dcat:Catalog>
+</rdf:RDF>
+'''
+
+
+def write_catalog(path, count):
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for i in range(count):
+            f.write(DATASET % {'i': i, 'k': i % 50})
+        f.write(FOOTER)
+
+
+def get_size(objects):
+    """
+    Get the number of bytes used by the objects, counting everything they
+    share only once
+    """
+    seen = set()
+
+    def size(value):
+        if value is None or id(value) in seen:
+            return 0
+        seen.add(id(value))
+        return sys.getsizeof(value)
+
+    total = 0
+    for obj in objects:
+        total += size(obj) + size(getattr(obj, '__dict__', None))
+        total += size(obj.id) + size(obj.fragment)
+        total += size(obj.attributes)
+        total += size(getattr(obj.attributes, '_keys', None))
+        total += size(getattr(obj.attributes, '_values', None))
+        for pred, terms in obj.attributes.items():
+            total += size(pred) + size(terms)
+            for term in terms:
+                total += size(term)
+    return total
+
+
+def load_graph(path):
+    graph = rdflib.Graph()
+    graph.load(path, format='application/rdf+xml')
+    rdf_dict = {}
+    for subj, pred, obj in graph:
+        if subj.toPython() not in rdf_dict:
+            rdf_dict[subj.toPython()] = {}
+        if pred.toPython() not in rdf_dict[subj.toPython()]:
+            rdf_dict[subj.toPython()][pred.toPython()] = []
+        rdf_dict[subj.toPython()][pred.toPython()].append(obj)
+    return [RdfObject(key, value, graph.namespace_manager)
+            for key, value in rdf_dict.iteritems()]
+
+
+def load_sink(path):
+    sink = parse_file(path)
+    sink.rename_bnodes()
+    return [RdfObject(subj.toPython(), attributes, sink.namespace_manager)
+            for subj, attributes in sink.subjects.iteritems()]
+
+
+METHODS = {'graph': load_graph, 'sink': load_sink}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] in METHODS:
+        start = time.time()
+        objects = METHODS[sys.argv[1]](sys.argv[2])
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print '%-6s %d objects in %.1f s, peak memory %d MB, ' \
+              'objects %d MB' % (sys.argv[1], len(objects),
+                                 time.time() - start, peak // 1024,
+                                 get_size(objects) // (1024 * 1024))
+        sys.exit(0)
+
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 10000
+
+    handle, path = tempfile.mkstemp(suffix='.rdf')
+    os.close(handle)
+    try:
+        write_catalog(path, count)
+        print 'Catalog with %d datasets, %d MB' % (
+            count, os.path.getsize(path) // (1024 * 1024))
+        for method in sorted(METHODS):
+            subprocess.check_call([sys.executable, __file__, method, path])
+    finally:
+        os.remove(path)
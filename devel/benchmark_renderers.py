@@ -0,0 +1,54 @@
+"""
+Benchmark the HTML renderers on generated nodes and make sure they produce
+the same markup.
+
+Usage: python benchmark_renderers.py [NUMBER_OF_NODES]
+"""
+import sys
+import time
+
+from rdfconv.renderers import RENDERERS, get_renderer
+
+
+def make_nodes(count):
+    nodes = []
+    for i in range(count):
+        attributes = [{'pred_link': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#about',
+                       'pred_title': 'About',
+                       'objs': [{'title': u'Dataset %d' % i,
+                                 'link': 'http://example.org/dataset/%d' % i}]}]
+        for j in range(10):
+            attributes.append({
+                'pred_link': 'http://purl.org/dc/terms/p%d' % j,
+                'pred_title': u'Predicate <%d>' % j,
+                'objs': [{'title': u'Literal "%d" & <a href=http://example.org>link</a>' % j},
+                         {'title': u'Linked \xe5\xe4\xf6 %d' % j,
+                          'link': '#%032x' % j}]})
+        nodes.append({'node_id': '%032x' % i,
+                      'rdf_about': 'http://example.org/dataset/%d' % i,
+                      'title': u'Dataset %d' % i,
+                      'rdf_type': u'Dataset',
+                      'desc': u'A description with a <a href=x>link</a>',
+                      'attributes': attributes})
+    return nodes
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 2000
+
+    nodes = make_nodes(count)
+    outputs = {}
+    for name in sorted(RENDERERS):
+        renderer = get_renderer(name)
+        start = time.time()
+        outputs[name] = renderer.render_page(nodes, '2015-01-01 00:00')
+        print '%-8s %d nodes in %.3f s' % (name, count, time.time() - start)
+
+    if len(set(outputs.values())) == 1:
+        print 'All renderers produced the same markup'
+    else:
+        print 'The renderers produced different markup'
+        sys.exit(1)
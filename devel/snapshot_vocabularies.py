@@ -0,0 +1,62 @@
+"""
+Download vocabularies and store their labels as snapshots that can be used
+with `rdf-to-html --offline`. This is used to update the snapshots bundled
+in rdfconv/vocabularies, or to create snapshots for a --vocabulary-dir.
+A snapshot holds the rdfs:label of each term of a vocabulary, in every
+language the vocabulary gives it in. Terms without a label are left out.
+Nothing is written unless all vocabularies could be downloaded, so a
+partial set never replaces the bundled one.
+
+Usage: python snapshot_vocabularies.py OUTPUT_DIR [VOCABULARY_URL ...]
+"""
+import os
+import sys
+import json
+
+from rdfconv.predicate import PredicateResolver
+
+# The vocabularies bundled with the converter
+VOCABULARIES = {
+    'dcat': 'http://www.w3.org/ns/dcat',
+    'dcterms': 'http://purl.org/dc/terms',
+    'foaf': 'http://xmlns.com/foaf/0.1',
+    'vcard': 'http://www.w3.org/2006/vcard/ns',
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns',
+    'rdfs': 'http://www.w3.org/2000/01/rdf-schema',
+    'odrs': 'http://schema.theodi.org/odrs',
+}
+
+
+def get_name(url):
+    for name, vocabulary_url in VOCABULARIES.items():
+        if vocabulary_url == url:
+            return name
+    return url.rstrip('/#').rsplit('/', 1)[-1]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+
+    output_dir = sys.argv[1]
+    urls = sys.argv[2:] or VOCABULARIES.values()
+
+    # Several vocabularies are on the same host, so one failure must not
+    # skip the others
+    resolver = PredicateResolver(breaker_reset=0)
+    snapshots = {}
+    for url in urls:
+        labels = resolver.fetch(url)
+        if not labels:
+            print 'Unable to download %s, nothing written' % url
+            sys.exit(1)
+        snapshots[url] = labels
+
+    for url, labels in sorted(snapshots.items()):
+        path = os.path.join(output_dir, get_name(url) + '.json')
+        with open(path, 'w') as f:
+            json.dump({'url': url, 'labels': labels}, f, indent=1,
+                      sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        print 'Wrote %d labels to %s' % (len(labels), path)
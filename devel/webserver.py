@@ -1,4 +1,6 @@
 import BaseHTTPServer
+import glob
+import os
 import sys
 
 HOST_NAME = 'localhost'
@@ -11,6 +13,22 @@ def get_content_type(filename):
 
     return "text/html; charset=utf8"
 
+def get_language_file(path, accept_language):
+    """
+    Find the file to serve for a path without a language suffix, such as
+    the links between pages, the way Apache mod_negotiation would
+    """
+    if os.path.exists(path):
+        return path
+    for language in accept_language.split(','):
+        language = language.split(';')[0].strip()
+        if language and os.path.exists('%s.%s' % (path, language)):
+            return '%s.%s' % (path, language)
+    versions = sorted(glob.glob(path + '.*'))
+    if versions:
+        return versions[0]
+    return path
+
 class HTMLHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """
     Simple web server that always sends all files (except css and javascript)
@@ -26,7 +44,9 @@ class HTMLHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     def do_GET(s):
         try:
-            with open(s.path[1:]) as f:
+            path = get_language_file(s.path[1:],
+                                     s.headers.get('Accept-Language', ''))
+            with open(path) as f:
                 s.send_response(200)
                 s.send_header("Content-Type", get_content_type(s.path))
                 s.end_headers()
@@ -0,0 +1,4 @@
+"""
+RDF to HTML converter
+"""
+__version__ = '1.1.0'
@@ -0,0 +1,405 @@
+"""
+Module containing persistent on-disk caches for vocabularies downloaded
+by the predicate resolver, for rendered HTML fragments and for parsed
+catalogs.
+"""
+import os
+import json
+import cPickle
+import time
+import errno
+import hashlib
+import logging
+import tempfile
+
+from rdfconv import __version__
+
+# One week
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+# One hour, used for vocabularies that couldn't be downloaded or parsed
+DEFAULT_NEGATIVE_TTL = 60 * 60
+
+# 50 MB
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+
+# 500 MB, a page of a large catalog easily takes up tens of MB
+DEFAULT_FRAGMENT_MAX_SIZE = 500 * 1024 * 1024
+
+ENTRY_SUFFIX = '.json'
+
+# Two gigabytes
+DEFAULT_CATALOG_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+CATALOG_SUFFIX = '.pickle'
+
+# Changed whenever the layout of the cached catalogs, or the naming of
+# their blank nodes, changes
+CATALOG_VERSION = 2
+
+# File holding the number of times the cached labels have changed
+GENERATION_FILE = 'generation'
+
+
+def get_default_cache_dir():
+    """
+    Get the default cache directory, following the XDG base directory
+    specification.
+    """
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'rdf-to-html')
+
+
+def _ensure_dir(directory):
+    """
+    Create a cache directory if it doesn't exist
+    """
+    try:
+        os.makedirs(directory)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            logging.warning('Unable to create cache directory %s. %s',
+                            directory, err)
+            return False
+    return True
+
+
+def _write_entry(directory, path, data, dump=json.dump):
+    """
+    Write a cache entry, as JSON unless another dump function is given.
+    The entry is written to a temporary file that is renamed, to avoid
+    other runs reading half written entries.
+    :return: True if the entry was written
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file_obj:
+                dump(data, file_obj)
+            os.rename(tmp_path, path)
+        finally:
+            # Unless it replaced the entry, don't leave it behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except (IOError, OSError, TypeError, ValueError,
+            cPickle.PicklingError) as err:
+        logging.warning('Unable to write cache entry %s. %s', path, err)
+        return False
+    return True
+
+
+def _dump_pickle(data, file_obj):
+    """
+    Pickle data to a file, with the binary protocol
+    """
+    cPickle.dump(data, file_obj, cPickle.HIGHEST_PROTOCOL)
+
+
+def _prune(directory, max_size, suffix=ENTRY_SUFFIX):
+    """
+    Remove the least recently written entries of a cache directory until
+    it is below its size limit
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+class CacheEntry(object):
+    """
+    Class representing a single cached vocabulary
+    """
+
+    def __init__(self, url, labels, fetched=None, etag=None,
+                 last_modified=None, failed=False):
+        self.url = url
+
+        # Negative entries remember vocabularies that couldn't be
+        # downloaded or parsed
+        self.failed = failed
+
+        # Dictionary of subject -> language -> label
+        self.labels = labels
+
+        # When the vocabulary was last fetched or revalidated
+        if fetched is None:
+            fetched = time.time()
+        self.fetched = fetched
+
+        # Validators used for conditional requests
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, ttl):
+        """
+        Is the entry younger than the given time to live?
+        """
+        return time.time() - self.fetched < ttl
+
+    def to_dict(self):
+        """
+        Get a JSON serializable representation of the entry
+        """
+        return {'url': self.url,
+                'fetched': self.fetched,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'failed': self.failed,
+                'labels': self.labels}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create an entry from its JSON representation
+        """
+        return cls(data['url'], data['labels'],
+                   fetched=data.get('fetched', 0),
+                   etag=data.get('etag'),
+                   last_modified=data.get('last_modified'),
+                   failed=data.get('failed', False))
+
+
+class VocabularyCache(object):
+    """
+    Persistent cache of parsed vocabularies shared by all runs of the
+    converter. Each vocabulary is stored as a separate JSON file in the
+    cache directory.
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL,
+                 max_size=DEFAULT_MAX_SIZE, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        if not cache_dir:
+            cache_dir = get_default_cache_dir()
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+
+    def _get_path(self, url):
+        """
+        Get the path of the file holding the cache entry for an url
+        """
+        name = hashlib.md5(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name + ENTRY_SUFFIX)
+
+    def get(self, url):
+        """
+        Get the cache entry for an url, stale or not.
+        :param url: url of the vocabulary
+        :return: a CacheEntry or None if the url isn't cached
+        """
+        path = self._get_path(url)
+        try:
+            with open(path) as file_obj:
+                entry = CacheEntry.from_dict(json.load(file_obj))
+        except (IOError, OSError):
+            return None
+        except (ValueError, KeyError) as err:
+            # A broken entry is no worse than a missing one
+            logging.warning('Ignoring corrupt cache entry %s. %s', path, err)
+            return None
+
+        if entry.url != url:
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        Can the entry be used without revalidating it?
+        """
+        if entry.failed:
+            return entry.is_fresh(self.negative_ttl)
+        return entry.is_fresh(self.ttl)
+
+    def put(self, entry):
+        """
+        Store an entry in the cache
+        :param entry: CacheEntry to store
+        """
+        if not _ensure_dir(self.cache_dir):
+            return
+
+        old_entry = self.get(entry.url)
+        path = self._get_path(entry.url)
+        if not _write_entry(self.cache_dir, path, entry.to_dict()):
+            return
+
+        if (not old_entry or old_entry.failed != entry.failed or
+                old_entry.labels != entry.labels):
+            self._increment_generation()
+        _prune(self.cache_dir, self.max_size)
+
+    def get_generation(self):
+        """
+        Get an identifier that changes whenever the cached labels change.
+        It also changes once every ttl, since vocabularies are only
+        revalidated when they are used.
+        """
+        return '%d-%d' % (self._read_generation(), time.time() // self.ttl)
+
+    def _read_generation(self):
+        """
+        Get the number of times the cached labels have changed
+        """
+        path = os.path.join(self.cache_dir, GENERATION_FILE)
+        try:
+            with open(path) as file_obj:
+                return int(json.load(file_obj))
+        except (IOError, OSError, ValueError, TypeError):
+            return 0
+
+    def _increment_generation(self):
+        """
+        Register that the cached labels have changed
+        """
+        path = os.path.join(self.cache_dir, GENERATION_FILE)
+        _write_entry(self.cache_dir, path, self._read_generation() + 1)
+
+    def touch(self, entry):
+        """
+        Mark an entry as revalidated
+        """
+        entry.fetched = time.time()
+        self.put(entry)
+
+
+class FragmentCache(object):
+    """
+    Persistent cache of the rendered HTML of each node of a page, so
+    nodes that haven't changed since the page was last written don't
+    have to be rendered again. The fragments of each page are stored as a
+    single JSON file, holding only the fragments used the last time the
+    page was written.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_FRAGMENT_MAX_SIZE):
+        if not cache_dir:
+            cache_dir = os.path.join(get_default_cache_dir(), 'fragments')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _get_path(self, page):
+        """
+        Get the path of the file holding the fragments of a page
+        """
+        page = os.path.abspath(page)
+        if isinstance(page, unicode):
+            page = page.encode('utf-8')
+        name = hashlib.md5(page).hexdigest()
+        return os.path.join(self.cache_dir, name + ENTRY_SUFFIX)
+
+    def load(self, page):
+        """
+        Get the fragments of a page
+        :param page: path of the HTML page
+        :return: dictionary of fragment key -> fragment
+        """
+        path = self._get_path(page)
+        try:
+            with open(path) as file_obj:
+                data = json.load(file_obj)
+            if data['page'] != os.path.abspath(page):
+                return {}
+            return data['fragments']
+        except (IOError, OSError):
+            return {}
+        except (ValueError, KeyError, TypeError) as err:
+            logging.warning('Ignoring corrupt cache entry %s. %s', path, err)
+            return {}
+
+    def save(self, page, fragments):
+        """
+        Replace the fragments of a page
+        :param page: path of the HTML page
+        :param fragments: dictionary of fragment key -> fragment
+        """
+        if not _ensure_dir(self.cache_dir):
+            return
+
+        data = {'page': os.path.abspath(page), 'fragments': fragments}
+        if _write_entry(self.cache_dir, self._get_path(page), data):
+            _prune(self.cache_dir, self.max_size)
+
+
+class CatalogCache(object):
+    """
+    Persistent cache of parsed RDF files, so a file that hasn't changed
+    doesn't have to be parsed again when only the templates or languages
+    have. A catalog is stored as a pickle keyed by the hash of the
+    content of the file, its format and the converter version.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_CATALOG_MAX_SIZE):
+        if not cache_dir:
+            cache_dir = os.path.join(get_default_cache_dir(), 'catalogs')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _get_path(self, file_hash, rdf_format):
+        """
+        Get the path of the file holding a catalog
+        """
+        key = '%s %s %s %d' % (file_hash, rdf_format, __version__,
+                               CATALOG_VERSION)
+        name = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.cache_dir, name + CATALOG_SUFFIX)
+
+    def load(self, file_hash, rdf_format):
+        """
+        Get a parsed catalog
+        :param file_hash: hash of the content of the RDF file
+        :param rdf_format: format the file was parsed as
+        :return: the catalog passed to save or None
+        """
+        path = self._get_path(file_hash, rdf_format)
+        try:
+            with open(path, 'rb') as file_obj:
+                catalog = cPickle.load(file_obj)
+        except (IOError, OSError):
+            return None
+        except Exception as err:  # pylint: disable=W0703
+            # Unpickling a truncated or otherwise broken file can raise
+            # almost anything
+            logging.warning('Ignoring corrupt cache entry %s. %s', path, err)
+            return None
+
+        # Touch the entry, so the most recently used catalogs are kept
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return catalog
+
+    def save(self, file_hash, rdf_format, catalog):
+        """
+        Store a parsed catalog
+        :param file_hash: hash of the content of the RDF file
+        :param rdf_format: format the file was parsed as
+        :param catalog: picklable representation of the parsed file
+        """
+        if not _ensure_dir(self.cache_dir):
+            return
+
+        path = self._get_path(file_hash, rdf_format)
+        if _write_entry(self.cache_dir, path, catalog, _dump_pickle):
+            _prune(self.cache_dir, self.max_size, CATALOG_SUFFIX)
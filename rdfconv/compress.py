@@ -0,0 +1,177 @@
+"""
+Module for writing precompressed variants of the output files, so the web
+server doesn't have to compress the pages on every request. A variant is
+named after its file with the suffix of its encoding, such as
+DCAT_FILE.html.en.gz, which Apache with MultiViews and
+
+    AddEncoding gzip .gz
+    AddEncoding br .br
+
+negotiates by both language and encoding when DCAT_FILE.html is requested.
+"""
+import os
+import gzip
+import logging
+from cStringIO import StringIO
+
+from rdfconv.utils import fork_map, output_file
+
+GZIP = 'gzip'
+BROTLI = 'brotli'
+
+# Suffixes of the variants by encoding
+SUFFIXES = {
+    GZIP: '.gz',
+    BROTLI: '.br',
+}
+
+ENCODINGS = sorted(SUFFIXES)
+
+
+class Error(Exception):
+    """
+    Base class for exceptions in this module
+    """
+    pass
+
+
+class CompressionError(Error):
+    """
+    Raised when an unknown encoding is requested or an encoding can't be
+    used
+    """
+    pass
+
+
+def check_encodings(encodings):
+    """
+    Check that files can be compressed with some encodings
+    :param encodings: list of ENCODINGS
+    """
+    for encoding in encodings:
+        if encoding not in SUFFIXES:
+            raise CompressionError('Unknown encoding %s. Available encodings: '
+                                   '%s' % (encoding, ', '.join(ENCODINGS)))
+        if encoding == BROTLI:
+            _get_brotli()
+
+
+def _get_brotli():
+    """
+    Get the brotli module, which is optional
+    """
+    try:
+        import brotli
+    except ImportError:
+        raise CompressionError('Brotli compression requires brotli to be '
+                               'installed')
+    return brotli
+
+
+def get_compressed_path(path, encoding):
+    """
+    Get the path of the variant of a file compressed with an encoding
+    """
+    return path + SUFFIXES[encoding]
+
+
+def compress_files(paths, encodings, processes=1, changed=None):
+    """
+    Write the variants of files compressed with some encodings. Variants
+    of other encodings are removed, since the web server would otherwise
+    keep serving them after their files have changed.
+    :param paths: paths of the files
+    :param encodings: list of ENCODINGS, may be empty
+    :param processes: maximum number of processes to compress with
+    :param changed: paths of the files that were written, see
+                    utils.output_file. The variants of the other files are
+                    only written if they are missing or older than their
+                    file. Every variant is written if omitted.
+    :return: list of the paths of the variants
+    """
+    for path in paths:
+        remove_compressed(path, [encoding for encoding in ENCODINGS
+                                 if encoding not in encodings])
+
+    items = [(path, encoding) for path in paths for encoding in encodings]
+    if changed is not None:
+        changed = set(changed)
+        outdated = [item for item in items
+                    if item[0] in changed or _is_outdated(*item)]
+    else:
+        outdated = items
+    written = fork_map(_compress_file, None, outdated, processes)
+    logging.debug('Compressed %d of %d files', sum(written), len(items))
+
+    return [get_compressed_path(path, encoding) for path, encoding in items]
+
+
+def _is_outdated(path, encoding):
+    """
+    Is the variant of a file missing or older than the file? Unchanged
+    files keep their modification time, so this catches variants left
+    behind by a conversion that was interrupted.
+    """
+    compressed_path = get_compressed_path(path, encoding)
+    try:
+        return os.path.getmtime(compressed_path) < os.path.getmtime(path)
+    except OSError:
+        return True
+
+
+def remove_compressed(path, encodings=None):
+    """
+    Remove the compressed variants of a file
+    :param encodings: list of ENCODINGS, every encoding if omitted
+    """
+    if encodings is None:
+        encodings = ENCODINGS
+    for encoding in encodings:
+        compressed_path = get_compressed_path(path, encoding)
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+
+
+def _compress_file(_, item):
+    """
+    Write the compressed variant of a file. Called through fork_map.
+    :param item: tuple of the path of the file and the encoding
+    :return: True if the variant changed
+    """
+    path, encoding = item
+    with open(path, 'rb') as file_obj:
+        data = file_obj.read()
+
+    # Readers never see a partly written variant. The same content is
+    # always compressed to the same bytes, so a variant that is the same
+    # keeps its modification time.
+    compressed_path = get_compressed_path(path, encoding)
+    changed = []
+    with output_file(compressed_path, True, None, changed) as file_obj:
+        file_obj.write(_compress(data, encoding))
+
+    # The file was touched without changing. The variant is marked as
+    # current, so it isn't compressed again by every conversion.
+    if not changed and _is_outdated(path, encoding):
+        os.utime(compressed_path, None)
+    return bool(changed)
+
+
+def _compress(data, encoding):
+    """
+    Compress data with an encoding, as hard as possible since every
+    variant is served many times
+    """
+    if encoding == BROTLI:
+        return _get_brotli().compress(data)
+
+    # Without a file name or modification time in the header, so the
+    # same content is always compressed to the same bytes
+    buf = StringIO()
+    gzip_file = gzip.GzipFile('', 'wb', 9, buf, 0)
+    try:
+        gzip_file.write(data)
+    finally:
+        gzip_file.close()
+    return buf.getvalue()
+
@@ -3,15 +3,21 @@ This module contains code for converting RDF-files into HTML
 """
 import os
 import logging
-import shutil
+import multiprocessing
+from datetime import datetime
 from collections import OrderedDict
 
 import rdflib
-from rdflib.term import Literal
 
-from rdfconv.utils import get_file
+from rdfconv.utils import get_file, fork_map, copy_file
 from rdfconv.html import HtmlConverter
-from rdfconv.objects import RdfObject
+from rdfconv.renderers import get_renderer
+from rdfconv.objects import RdfObject, TYPE
+from rdfconv.predicate import get_shared_resolver
+from rdfconv.ingest import parse_file, guess_format
+from rdfconv.manifest import get_file_hash
+from rdfconv.store import ObjectStore, StoreSink
+from rdfconv.compress import compress_files, get_compressed_path
 
 if not logging:
     # rdflib requires a logger to be setup
@@ -46,17 +52,57 @@ class LanguageError(Error):
         return self.msg
 
 
+def _parse_catalog(filename, rdf_format):
+    """
+    Parse an RDF file into the form stored by rdfconv.cache.CatalogCache
+    :return: dictionary of the subjects with their attributes, the
+    languages of the literals and the namespace bindings
+    """
+    # The triples are grouped by subject while the file is parsed,
+    # instead of being stored in a graph first
+    sink = parse_file(filename, rdf_format)
+    sink.rename_bnodes()
+
+    subjects = []
+    for subj, attributes in sink.subjects.iteritems():
+        # Triples are parsed in no particular order, so objects with
+        # the same title would otherwise be output in a different
+        # order every time. Like renaming the blank nodes this is done
+        # without --stable too, it costs little next to the parsing and
+        # the result is cached.
+        for obj_list in attributes.itervalues():
+            obj_list.sort(key=lambda term: term.n3())
+        subjects.append((subj.toPython(), attributes))
+
+    namespaces = [(prefix, unicode(namespace)) for prefix, namespace
+                  in sink.namespace_manager.namespaces()]
+    return {'subjects': subjects,
+            'languages': sorted(sink.languages),
+            'namespaces': namespaces}
+
+
+def _output_language(html_conv, output):
+    """
+    Render a single language, in a forked process if several languages
+    are rendered in parallel
+    :return: tuple of the files written and those whose content changed
+    """
+    path, language = output
+    changed = []
+    paths = html_conv.output_html(path, language, changed)
+    return paths, changed
+
+
 class RDFtoHTMLConverter(object):
     """
     Class representing a RDF to HTML converter
     """
 
-    def __init__(self, languages=None):
+    def __init__(self, languages=None, vocabulary_cache=None, pred_res=None):
         if not languages:
             languages = ['all']
 
-        # References to the underlying graph
-        self._graph = None
+        # Prefixes of the loaded file
         self._ns_mgr = None
 
         # Dictionary representation of the RDF file
@@ -73,6 +119,63 @@ class RDFtoHTMLConverter(object):
 
         self._skip_links = False
 
+        # Write the HTML one node at a time, see HtmlConverter
+        self.stream_output = False
+
+        # Renderer used for the HTML, see rdfconv.renderers
+        self.renderer = None
+
+        # Number of languages rendered in parallel
+        self.language_jobs = 1
+
+        # Number of processes each language is split between, see
+        # HtmlConverter
+        self.shards = 1
+
+        # Cache of rendered nodes reused between runs, see
+        # rdfconv.cache.FragmentCache
+        self.fragment_cache = None
+
+        # Cache of parsed files reused between runs, see
+        # rdfconv.cache.CatalogCache
+        self.catalog_cache = None
+
+        # Keep the objects in an SQLite database instead of in memory,
+        # see rdfconv.store
+        self.disk_store = False
+        self._store = None
+
+        # Number of nodes per page, see HtmlConverter. By default every
+        # node is written to a single page.
+        self.page_size = 0
+
+        # Only render the summaries of the nodes, leaving their tables to
+        # rdfconv.js, see HtmlConverter
+        self.lazy_details = False
+
+        # Encodings of the precompressed variants written next to every
+        # output file, see rdfconv.compress
+        self.compress = []
+
+        # Number of processes the variants are compressed with, the number
+        # of CPUs if None. Conversions in a --jobs worker compress in the
+        # worker itself, see utils.fork_map.
+        self.compress_jobs = None
+
+        # Only change the output when the input changes. The pages are
+        # dated with the modification time of the input and files are
+        # only replaced if their content differs.
+        self.stable_output = False
+
+        # Modification time of the loaded file
+        self._input_date = None
+
+        # Resolver for human readable predicate names. Unless one is
+        # given, use the one shared by all converters in the process.
+        if not pred_res:
+            pred_res = get_shared_resolver(vocabulary_cache)
+        self._pred_res = pred_res
+
     @property
     def skip_links(self):
         """
@@ -92,51 +195,127 @@ class RDFtoHTMLConverter(object):
         """
         self._skip_links = value
 
-    def load_file(self, filename):
+    def get_output_options(self):
+        """
+        Get the options that affect the files written by output_html,
+        recorded in the build manifest, see rdfconv.manifest
+        :return: dictionary of option -> value
+        """
+        renderer = self.renderer or get_renderer()
+        return {'skip_links': self.skip_links,
+                'stable': self.stable_output,
+                'page_size': self.page_size,
+                'lazy_details': self.lazy_details,
+                'compress': sorted(self.compress),
+                'renderer': '%s-%s' % (renderer.__class__.__name__,
+                                       renderer.version)}
+
+    def load_file(self, filename, rdf_format=None, file_hash=None):
         """
         Read RDF data from file
+        :param filename: path of the file
+        :param rdf_format: format of the file, guessed if omitted
+        :param file_hash: hash of the content of the file, computed if
+        omitted and needed by the catalog cache
         """
         self.input_file = os.path.basename(filename)
+        self._input_date = datetime.fromtimestamp(os.path.getmtime(filename))
 
-        # Load graph from file
-        self._graph = rdflib.Graph()
-        self._graph.load(filename, format='application/rdf+xml')
+        if self.disk_store:
+            self._load_store(filename, rdf_format)
+        else:
+            self._load_catalog(filename, rdf_format, file_hash)
 
-        # Easy access to namespace manager
-        self._ns_mgr = self._graph.namespace_manager
+        self._validate_languages()
 
-        # Build dictionary
-        rdf_dict = {}
-        for subj, pred, obj in self._graph:
+    def _load_catalog(self, filename, rdf_format, file_hash):
+        """
+        Read RDF data from file into memory
+        """
+        if not rdf_format:
+            rdf_format = guess_format(filename)
+
+        catalog = None
+        if self.catalog_cache:
+            if not file_hash:
+                file_hash = get_file_hash(filename)
+            catalog = self.catalog_cache.load(file_hash, rdf_format)
+            if catalog:
+                logging.info('Reusing parsed %s', filename)
+
+        if not catalog:
+            catalog = _parse_catalog(filename, rdf_format)
+            if self.catalog_cache:
+                self.catalog_cache.save(file_hash, rdf_format, catalog)
 
-            if subj.toPython() not in rdf_dict:
-                rdf_dict[subj.toPython()] = {}
-            if pred.toPython() not in rdf_dict[subj.toPython()]:
-                rdf_dict[subj.toPython()][pred.toPython()] = []
+        # Easy access to namespace manager
+        graph = rdflib.Graph()
+        for prefix, namespace in catalog['namespaces']:
+            graph.namespace_manager.bind(prefix, namespace, replace=True)
+        self._ns_mgr = graph.namespace_manager
 
-            rdf_dict[subj.toPython()][pred.toPython()].append(obj)
-            if isinstance(obj, Literal):
-                if obj.language:
-                    # Literals can have a language tag,
-                    # Keep track of all languages encountered
-                    self.languages.add(obj.language)
+        # Literals can have a language tag,
+        # Keep track of all languages encountered
+        self.languages.update(catalog['languages'])
 
         # Generate objects
-        objects = []
-        for key, value in rdf_dict.iteritems():
-            obj = RdfObject(key, value, self._ns_mgr)
-            objects.append(obj)
+        objects = [RdfObject(subj, attributes, self._ns_mgr)
+                   for subj, attributes in catalog['subjects']]
+
+        # The objects now hold the triples
+        del catalog
 
-        # Sort them by type -> title
+        # Sort them by type -> title -> id, the same order as the
+        # ObjectStore
         self.objects = OrderedDict()
-        for obj in sorted(objects, key=lambda x: x.get_sort_tuple('en')):
+        for obj in sorted(objects,
+                          key=lambda x: x.get_sort_tuple('en') + (x.id,)):
             self.objects[obj.id] = obj
 
-        self._validate_languages()
+    def _load_store(self, filename, rdf_format):
+        """
+        Read RDF data from file into a disk-backed store, which is kept
+        until the converter is closed
+        """
+        self.close()
+        store = ObjectStore()
+        try:
+            sink = parse_file(filename, rdf_format, StoreSink(store))
+            store.build(sink.namespace_manager)
+        except Exception:
+            store.close()
+            raise
+
+        self._store = store
+        self._ns_mgr = sink.namespace_manager
+        self.languages.update(sink.languages)
+        self.objects = store
+
+    def close(self):
+        """
+        Remove the disk-backed store of the loaded file, if any
+        """
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def prefetch_vocabularies(self):
+        """
+        Download the vocabularies of all predicates and types in the
+        loaded file in parallel, before the rendering needs them. Called
+        by output_html, since loading a file doesn't need them.
+        """
+        urls = set()
+        for obj in self.objects.itervalues():
+            urls.update(obj.attributes.keys())
+            for rdf_type in obj.attributes.get(TYPE, []):
+                urls.add(unicode(rdf_type))
+        self._pred_res.prefetch(urls)
 
     def output_html(self, folder):
         """
         Output one file per language encountered in the rdf file
+        :return: list of the files written
         """
         if not os.path.exists(folder):
             os.mkdir(folder)
@@ -147,22 +326,78 @@ class RDFtoHTMLConverter(object):
 
         # Move script and style files
         base_dir = os.path.dirname(os.path.abspath(__file__))
-        shutil.copy(os.path.join(base_dir, 'includes/style.css'), folder)
-        shutil.copy(os.path.join(base_dir, 'includes/rdfconv.js'), folder)
+        includes = []
+        changed = []
+        for include in ('style.css', 'rdfconv.js'):
+            includes.append(os.path.join(folder, include))
+            copy_file(os.path.join(base_dir, 'includes', include),
+                      includes[-1], self.stable_output, changed)
+
+        self.prefetch_vocabularies()
 
-        html_conv = HtmlConverter(self.objects, self._ns_mgr)
+        html_conv = HtmlConverter(self.objects, self._ns_mgr, self._pred_res,
+                                  self.renderer)
         if self.skip_links:
             html_conv.skip_literal_links = True
             html_conv.skip_internal_links = True
+        html_conv.stream_output = self.stream_output
+        # Streaming is meant to keep memory bounded, so the skeletons of
+        # the nodes are built again for every language instead of kept
+        html_conv.keep_skeletons = not self.stream_output
+        html_conv.shards = self.shards
+        html_conv.page_size = self.page_size
+        html_conv.lazy_details = self.lazy_details
+        html_conv.name = os.path.splitext(self.input_file)[0]
+        html_conv.fragment_cache = self.fragment_cache
+        if self.stable_output:
+            html_conv.date = self._input_date
+            html_conv.write_if_changed = True
+        if self.disk_store:
+            # Only the node being written is kept in memory. The cached
+            # fragments of a page would hold all of them.
+            html_conv.stream_output = True
+            html_conv.keep_skeletons = False
+            html_conv.fragment_cache = None
 
         # Assume english if no language was encountered
         if not self.languages:
             self.languages.add('en')
+        outputs = []
         for language in self.languages:
             filename = os.path.splitext(self.input_file)[0]
             filename = get_file(filename, language)
             path = os.path.join(folder, filename)
-            html_conv.output_html(path, language)
+            outputs.append((path, language))
+
+        if self.language_jobs > 1 and len(outputs) > 1:
+            # The converter is prepared before the worker processes are
+            # forked, so they inherit it instead of having it pickled for
+            # every language
+            if self.shards < 2:
+                html_conv.prepare()
+            if self._store is not None:
+                self._store.disconnect()
+            written = fork_map(_output_language, html_conv, outputs,
+                               self.language_jobs)
+        else:
+            written = [_output_language(html_conv, output)
+                       for output in outputs]
+
+        paths = [page for files, _ in written for page in files]
+        if self.stable_output:
+            changed += [page for _, files in written for page in files]
+        else:
+            # Every file was written, so the modification times tell which
+            # variants are outdated
+            changed = None
+        compress_files(includes + paths, self.compress,
+                       self.compress_jobs or multiprocessing.cpu_count(),
+                       changed)
+
+        # The includes are shared by every file in the folder, so neither
+        # they nor their variants are outputs of this one
+        return paths + [get_compressed_path(page, encoding)
+                        for page in paths for encoding in self.compress]
 
     def get_nodes(self, language):
         """
@@ -175,7 +410,7 @@ class RDFtoHTMLConverter(object):
         :return: a list of nested dictionaries with information
                  about each node in the RDF file
         """
-        html_conv = HtmlConverter(self.objects, self._ns_mgr)
+        html_conv = HtmlConverter(self.objects, self._ns_mgr, self._pred_res)
         if self.skip_links:
             html_conv.skip_literal_links = True
             html_conv.skip_internal_links = True
@@ -2,17 +2,26 @@
 Contains code related to outputing HTML
 """
 import os
+import json
 import codecs
+import shutil
+import tempfile
 import urllib2
 import re
+import hashlib
+import logging
+import threading
 from datetime import datetime
+from itertools import islice
+from collections import OrderedDict
 
 from rdflib.term import URIRef, BNode, Literal
-from django.template import Context
-from django.template.loader import get_template
-from django.conf import settings
 
-from rdfconv.predicate import PredicateResolver
+from rdfconv.predicate import get_shared_resolver
+from rdfconv.renderers import get_renderer
+from rdfconv.compress import remove_compressed
+from rdfconv.utils import fork_map, output_file, get_file, get_page_name, \
+    get_link_file, get_details_file
 
 
 RDF_ABOUT = URIRef(u'http://www.w3.org/1999/02/22-rdf-syntax-ns#about')
@@ -24,81 +33,585 @@ DISTRIBUTION = URIRef(u'http://www.w3.org/ns/dcat#Distribution')
 OBJ_ORDER = [CATALOG, DATASET, DISTRIBUTION]
 
 
+def _output_shard(state, shard):
+    """
+    Build and render a shard of the nodes in a forked process
+    """
+    html_conv, cached, details = state
+    start, end, language, path = shard
+    objects = islice(html_conv.iter_ordered_objects(), start, end)
+    used = html_conv.write_nodes(objects, language, path, cached, details)
+    if used is None:
+        return None
+
+    # Only send back the fragments the parent process doesn't have
+    return [(key, None if key in cached else fragment)
+            for key, fragment in used.iteritems()]
+
+
 class HtmlConverter(object):
     """
     Class that converts a dictionary of RdfObjects into HTML
     """
 
-    def __init__(self, rdf_objects, ns_mgr):
+    def __init__(self, rdf_objects, ns_mgr, pred_res=None, renderer=None):
         self.objects = rdf_objects
         self._ns_mgr = ns_mgr
 
         # Predicate resolver
-        self._pred_res = PredicateResolver()
+        if not pred_res:
+            pred_res = get_shared_resolver()
+        self._pred_res = pred_res
 
-        # Init templates
-
-        if not settings.configured:
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            settings.configure(
-                TEMPLATE_DIRS=(os.path.join(base_dir, 'templates'),),
-                TEMPLATE_LOADERS=("django.template.loaders.filesystem.Loader",),
-                TEMPLATE_DEBUG=True)
+        # Renderer turning nodes into HTML, see rdfconv.renderers
+        if not renderer:
+            renderer = get_renderer()
+        self.renderer = renderer
 
         self.skip_internal_links = False
         self.skip_literal_links = False
 
+        # Write one node at a time instead of rendering the whole page
+        # in memory
+        self.stream_output = False
+
+        # Number of processes the nodes are split between when writing
+        # a page
+        self.shards = 1
+
+        # Cache of rendered nodes, see rdfconv.cache.FragmentCache. Not
+        # used when streaming, since it holds every node of a page.
+        self.fragment_cache = None
+
+        # Date shown as updated on the pages. Defaults to the current time.
+        self.date = None
+
+        # Only replace pages whose content changed, see
+        # rdfconv.utils.output_file
+        self.write_if_changed = False
+
+        # Keep the language independent parts of the nodes between
+        # languages. Turned off when the objects don't fit in memory.
+        self.keep_skeletons = True
+
+        # Number of nodes per page. If set the nodes are split between
+        # pages listed on an index page, see _output_paged.
+        self.page_size = 0
+
+        # Name of the output files, see rdfconv.utils.get_file. Used to
+        # link between pages.
+        self.name = None
+
+        # Only render the summaries of the nodes. Their tables are written
+        # to a JSON file next to each page and built by rdfconv.js when
+        # they are shown, see _write_details.
+        self.lazy_details = False
+
+        # Object id -> number of the page it is on, see _get_pages
+        self._pages = None
+
+        # Language independent parts of the nodes by object id, see
+        # _get_skeletons
+        self._skeletons = None
+        self._skeletons_key = None
+
     def build_node_dict(self, language):
         """
         Build list of nested dictionaries to use as an intermediate
         format before rendering the HTML.
 
+        Everything that doesn't depend on the language is only computed
+        once, see _get_skeletons, so the cost of each additional language
+        is limited to selecting literals and labels.
+
         :param language: language to convert to
         :returns: dictionary with nodes
         """
-        objects = []
-        for rdf_type in OBJ_ORDER:
-            for obj in self.objects.values():
-                if obj.type == rdf_type:
-                    objects.append(obj)
+        return list(self.iter_nodes(language))
 
-        for obj in self.objects.values():
-            if obj not in objects:
-                objects.append(obj)
+    def iter_nodes(self, language, objects=None, details=None):
+        """
+        Generate the nodes of build_node_dict one at a time
+        :param language: language to convert to
+        :param objects: iterable of the RdfObjects to build nodes of,
+                        every object if omitted
+        :param details: name of the JSON file holding the tables of the
+                        nodes, see _write_details. The tables are part of
+                        the nodes if omitted.
+        """
+        if objects is None and self.keep_skeletons:
+            for skeleton in self._get_skeletons().itervalues():
+                yield self._build_node(skeleton, language, details)
+            return
 
-        nodes = []
+        if objects is None:
+            objects = self.iter_ordered_objects()
         for obj in objects:
-            node_dict = {'node_id': obj.fragment,
-                         'rdf_about': obj.id}
-            summary = self._format_summary(obj, language)
-            attributes = self._format_node(obj, language)
+            yield self._build_node(self._get_skeleton(obj), language,
+                                   details)
+
+    def _build_node(self, skeleton, language, details=None):
+        """
+        Build the node of a single object from its skeleton
+        :param details: name of the JSON file holding the table of the
+                        node, see iter_nodes
+        """
+        node_dict = {'node_id': skeleton['obj'].fragment,
+                     'rdf_about': skeleton['obj'].id}
+        summary = self._format_summary(skeleton['obj'], language)
+        node_dict.update(summary)
+
+        if details:
+            node_dict['details'] = details
+        else:
+            node_dict['attributes'] = self._format_node(skeleton, language)
+
+        return node_dict
+
+    def prepare(self):
+        """
+        Build everything that doesn't depend on the language up front
+        """
+        if self.page_size:
+            self._get_pages()
+        if self.keep_skeletons:
+            self._get_skeletons()
+
+    def _get_skeletons(self):
+        """
+        Get the language independent part of every node, in the order
+        they should be output. The skeletons are built the first time
+        they are needed and reused for all languages.
+        :return: OrderedDict of object id -> skeleton
+        """
+        key = (self.skip_internal_links, self.skip_literal_links,
+               self.page_size)
+        if self._skeletons is None or self._skeletons_key != key:
+            self._skeletons = OrderedDict(
+                (obj.id, self._build_skeleton(obj))
+                for obj in self.iter_ordered_objects())
+            self._skeletons_key = key
+        return self._skeletons
+
+    def _get_skeleton(self, rdf_obj):
+        """
+        Get the language independent part of the node of an object
+        """
+        if self.keep_skeletons:
+            return self._get_skeletons()[rdf_obj.id]
+        return self._build_skeleton(rdf_obj)
 
-            node_dict.update(summary)
-            node_dict.update({'attributes': attributes})
+    def _get_pages(self):
+        """
+        Get the number of the page every object is on when the nodes are
+        split between pages, see _output_paged
+        :return: dictionary of object id -> page number, starting at 1
+        """
+        if self._pages is None:
+            self._pages = {}
+            for position, obj in enumerate(self.iter_ordered_objects()):
+                self._pages[obj.id] = position // self.page_size + 1
+        return self._pages
 
-            nodes.append(node_dict)
-        return nodes
+    def iter_ordered_objects(self):
+        """
+        Generate the objects with catalogs, datasets and distributions
+        first
+        """
+        for rdf_type in OBJ_ORDER:
+            for obj in self._select_objects([rdf_type]):
+                yield obj
+
+        for obj in self._select_objects(OBJ_ORDER, exclude=True):
+            yield obj
+
+    def _select_objects(self, rdf_types, exclude=False):
+        """
+        Generate the objects of some types, or of any other type if
+        exclude is set. A disk-backed rdfconv.store.ObjectStore selects
+        them using its index instead of loading every object.
+        """
+        if hasattr(self.objects, 'select'):
+            return self.objects.select(rdf_types, exclude)
+        return (obj for obj in self.objects.itervalues()
+                if (obj.type in rdf_types) != exclude)
 
-    def output_html(self, path, language):
+    def output_html(self, path, language, changed=None):
         """
         Output each node to a separate file per language
         :param path:
         :param language:
-        :return:
+        :param changed: list the paths of the files whose content changed
+                        are appended to, see utils.output_file
+        :return: list of the files written
         """
-        nodes = self.build_node_dict(language)
-
         # TODO: We might want to add the timezone here
-        date = datetime.now().strftime('%Y-%m-%d %H:%M')
+        date = (self.date or datetime.now()).strftime('%Y-%m-%d %H:%M')
+
+        if self.page_size:
+            return self._output_paged(path, language, date, changed)
+
+        paths = [path]
+        details = None
+        if self.lazy_details:
+            paths.append(self._write_details(path, language,
+                                             changed=changed))
+            details = os.path.basename(paths[-1])
+
+        if self.shards > 1:
+            self._output_sharded(path, language, date, details, changed)
+            return paths
+
+        if self._use_fragment_cache():
+            self._output_cached(path, language, date, details=details,
+                                changed=changed)
+            return paths
+
+        if self.stream_output:
+            self._stream_html(path, language, date, details=details,
+                              changed=changed)
+            return paths
+
+        nodes = list(self.iter_nodes(language, details=details))
+        out = self.renderer.render_page(nodes, date)
+
+        with output_file(path, self.write_if_changed,
+                         changed=changed) as page:
+            page.write(out)
+        return paths
+
+    def _output_paged(self, path, language, date, changed=None):
+        """
+        Split the nodes between pages of at most page_size nodes, named
+        after the page number, and write an index page listing them to
+        path. Nodes link to nodes on other pages by the page name without
+        the language suffix, leaving the language to mod_negotiation.
+        :return: list of the files written
+        """
+        folder = os.path.dirname(path)
+        paths = []
+        pages = []
+
+        # The objects are read once, a page at a time
+        objects = self.iter_ordered_objects()
+        number = 1
+        while True:
+            page_objects = list(islice(objects, self.page_size))
+            if not page_objects:
+                break
+
+            name = get_page_name(self.name, number)
+            page_path = os.path.join(folder, get_file(name, language))
+            details = None
+            if self.lazy_details:
+                paths.append(self._write_details(page_path, language,
+                                                 page_objects, changed))
+                details = os.path.basename(paths[-1])
+            if self._use_fragment_cache():
+                self._output_cached(page_path, language, date, page_objects,
+                                    details, changed)
+            else:
+                self._stream_html(page_path, language, date, page_objects,
+                                  details, changed)
+            paths.append(page_path)
+
+            pages.append({'link': get_link_file(name),
+                          'first': page_objects[0].get_title(language),
+                          'last': page_objects[-1].get_title(language),
+                          'count': len(page_objects)})
+            number += 1
+
+        # Remove the pages left over from a larger catalog
+        while True:
+            name = get_page_name(self.name, number)
+            page_path = os.path.join(folder, get_file(name, language))
+            if not os.path.exists(page_path):
+                break
+            os.remove(page_path)
+            remove_compressed(page_path)
+            details_path = os.path.join(folder,
+                                        get_details_file(name, language))
+            if os.path.exists(details_path):
+                os.remove(details_path)
+                remove_compressed(details_path)
+            number += 1
+
+        with output_file(path, self.write_if_changed,
+                         changed=changed) as index:
+            title = self._get_index_title(language)
+            index.write(self.renderer.render_index(title, pages, date))
+        return [path] + paths
+
+    def _write_details(self, path, language, objects=None, changed=None):
+        """
+        Write the attribute tables of the nodes of a page to a JSON file
+        next to it, as an object of node id -> list of rows. Each row is
+        the link and title of a predicate followed by its objects, which
+        are lists of link and title or HTML strings. The nodes of the
+        page link to the file, see _build_node.
+        :param path: path of the page
+        :param objects: objects of the page, every object if omitted
+        :param changed: list of changed files, see output_html
+        :return: path of the JSON file
+        """
+        folder, filename = os.path.split(path)
+        suffix = get_file('', language)
+        if filename.endswith(suffix):
+            filename = filename[:-len(suffix)]
+        details_path = os.path.join(folder,
+                                    get_details_file(filename, language))
+
+        if objects is None and self.keep_skeletons:
+            skeletons = self._get_skeletons().itervalues()
+        else:
+            if objects is None:
+                objects = self.iter_ordered_objects()
+            skeletons = (self._get_skeleton(obj) for obj in objects)
+
+        with output_file(details_path, self.write_if_changed,
+                         changed=changed) as details:
+            separator = u'{'
+            for skeleton in skeletons:
+                rows = []
+                for attr in self._format_node(skeleton, language):
+                    row = [attr['pred_link'], attr['pred_title']]
+                    for obj in attr['objs']:
+                        if obj.get('link'):
+                            row.append([obj['link'], obj['title']])
+                        else:
+                            row.append(obj['title'])
+                    rows.append(row)
+
+                details.write(separator)
+                details.write(json.dumps(skeleton['obj'].fragment))
+                details.write(u':')
+                details.write(json.dumps(rows, ensure_ascii=False,
+                                         separators=(',', ':')))
+                separator = u',\n'
+            details.write(u'{}' if separator == u'{' else u'}')
+        return details_path
+
+    def _use_fragment_cache(self):
+        """
+        Should the rendered nodes be reused? The cached nodes of a page
+        and those rendered to replace them are all kept in memory, which
+        streaming is meant to avoid.
+        """
+        return self.fragment_cache is not None and not self.stream_output
+
+    def _get_index_title(self, language):
+        """
+        Get the title of the index page: the title of the catalog, or
+        the name of the files if there is none
+        """
+        for obj in self._select_objects([CATALOG]):
+            return obj.get_title(language)
+        return self.name
+
+    def _stream_html(self, path, language, date, objects=None,
+                     details=None, changed=None):
+        """
+        Render and write one node at a time. Unless keep_skeletons is
+        set, only a single node is kept in memory regardless of the size
+        of the catalog.
+        :param objects: objects to write, every object if omitted
+        :param details: name of the JSON file of the tables, see iter_nodes
+        :param changed: list of changed files, see output_html
+        """
+        nodes = self.iter_nodes(language, objects, details)
+        with output_file(path, self.write_if_changed,
+                         changed=changed) as page:
+            for part in self.renderer.iter_page(nodes, date):
+                page.write(part)
+
+    def _output_cached(self, path, language, date, objects=None,
+                       details=None, changed=None):
+        """
+        Write a page one node at a time, reusing the rendered nodes that
+        haven't changed since the page was last written
+        :param objects: objects to write, every object if omitted
+        :param details: name of the JSON file of the tables, see iter_nodes
+        :param changed: list of changed files, see output_html
+        """
+        if objects is None:
+            objects = self.iter_ordered_objects()
+        cached = self.fragment_cache.load(path)
+        used = {}
+        fragments = self._iter_fragments(objects, language, cached, used,
+                                         details)
+        with output_file(path, self.write_if_changed,
+                         changed=changed) as page:
+            page.write(self.renderer.render_start(date))
+            for part in self.renderer.iter_fragment_parts(fragments):
+                page.write(part)
+            page.write(self.renderer.render_end())
+
+        self._save_fragments(path, cached, used)
+
+    def _save_fragments(self, path, cached, used):
+        """
+        Store the rendered nodes of a page for the next time it is written
+        """
+        reused = sum(1 for key in used if key in cached)
+        logging.debug('Reused %d of %d nodes of %s', reused, len(used), path)
+        self.fragment_cache.save(path, used)
 
-        context = Context({'nodes': nodes,
-                           'date': date})
+    def _output_sharded(self, path, language, date, details=None,
+                        changed=None):
+        """
+        Split the nodes into contiguous shards that are built and rendered
+        in separate processes, and merge the results in order. Every
+        process inherits all objects, so fragment links resolve across
+        shards.
+        :param details: name of the JSON file of the tables, see iter_nodes
+        :param changed: list of changed files, see output_html
+        """
+        count = len(self.objects)
+        size = max(1, -(-count // self.shards))
+        folder = os.path.dirname(os.path.abspath(path))
 
-        main_template = get_template('main.html')
-        out = main_template.render(context)
+        cached = None
+        if self._use_fragment_cache():
+            cached = self.fragment_cache.load(path)
 
-        with codecs.open(path, 'w', 'utf-8') as output_file:
-            output_file.write(out)
+        shards = []
+        try:
+            for start in range(0, count, size):
+                handle, part_path = tempfile.mkstemp(dir=folder,
+                                                     suffix='.part')
+                os.close(handle)
+                shards.append((start, start + size, language, part_path))
+
+            # The processes open their own connections to a disk store,
+            # see store.ObjectStore.disconnect
+            disconnect = getattr(self.objects, 'disconnect', None)
+            if disconnect:
+                disconnect()
+            results = fork_map(_output_shard, (self, cached, details),
+                               shards, self.shards)
+
+            with output_file(path, self.write_if_changed, None,
+                             changed) as page:
+                page.write(self.renderer.render_start(date).encode('utf-8'))
+                for shard in shards:
+                    with open(shard[3], 'rb') as part_file:
+                        shutil.copyfileobj(part_file, page)
+                page.write(self.renderer.render_end().encode('utf-8'))
+        finally:
+            for shard in shards:
+                os.remove(shard[3])
+
+        if cached is not None:
+            used = {}
+            for rendered in results:
+                for key, fragment in rendered:
+                    used[key] = cached[key] if fragment is None else fragment
+            self._save_fragments(path, cached, used)
+
+    def write_nodes(self, objects, language, path, cached=None,
+                    details=None):
+        """
+        Build and render the nodes of some objects, without the rest of
+        the page
+        :param objects: iterable of RdfObjects
+        :param language: language to convert to
+        :param path: file to write the nodes to
+        :param cached: rendered nodes to reuse, see _iter_fragments. If
+                       omitted every node is rendered.
+        :param details: name of the JSON file of the tables, see iter_nodes
+        :return: dictionary of fragment key -> fragment of every node if
+                 cached nodes were given, otherwise None
+        """
+        used = None
+        if cached is None:
+            nodes = (self._build_node(self._build_skeleton(obj), language,
+                                      details)
+                     for obj in objects)
+            parts = self.renderer.iter_node_parts(nodes)
+        else:
+            used = {}
+            fragments = self._iter_fragments(objects, language, cached, used,
+                                             details)
+            parts = self.renderer.iter_fragment_parts(fragments)
+
+        with codecs.open(path, 'w', 'utf-8') as part_file:
+            for part in parts:
+                part_file.write(part)
+        return used
+
+    def _iter_fragments(self, objects, language, cached, used,
+                        details=None):
+        """
+        Render the nodes of some objects, reusing the nodes rendered
+        earlier for objects whose content hasn't changed
+        :param objects: iterable of RdfObjects
+        :param language: language to convert to
+        :param cached: dictionary of fragment key -> fragment rendered
+                       earlier
+        :param used: dictionary the fragments of every node are added to
+        :param details: name of the JSON file of the tables, see iter_nodes
+        """
+        salt = self._get_fragment_salt(details)
+        for obj in objects:
+            key = self._get_fragment_key(obj, language, salt)
+            fragment = cached.get(key)
+            if fragment is None:
+                node = self._build_node(self._build_skeleton(obj), language,
+                                        details)
+                fragment = self.renderer.render_node(node)
+            used[key] = fragment
+            yield fragment
+
+    def _get_fragment_salt(self, details=None):
+        """
+        Get everything outside of the objects themselves that affects how
+        every node is rendered
+        :param details: name of the JSON file of the tables, see iter_nodes
+        """
+        parts = [self.renderer.__class__.__name__,
+                 self.renderer.version,
+                 self.skip_internal_links,
+                 self.skip_literal_links,
+                 unicode(RDF_ABOUT) in self.objects,
+                 details]
+        # Links to other vocabularies are shortened using the prefixes
+        parts.extend(sorted(self._ns_mgr.namespaces()))
+        return u'\x00'.join(unicode(part) for part in parts)
+
+    def _get_fragment_key(self, rdf_obj, language, salt):
+        """
+        Get a hash of everything the rendered node of an object depends
+        on: the renderer, its triples, the titles and pages of the local
+        objects it links to and the labels of its predicates and type.
+        """
+        parts = [salt, language, rdf_obj.id]
+        if self.page_size:
+            parts.append(self._get_pages()[rdf_obj.id])
+        if rdf_obj.type:
+            parts.append(self._pred_res.resolve(rdf_obj.type.toPython(),
+                                                language))
+        for pred in sorted(rdf_obj.attributes.keys()):
+            parts.append(pred)
+            parts.append(self._pred_res.resolve(pred, language))
+            for obj in rdf_obj.attributes[pred]:
+                parts.extend(_get_term_key(obj))
+                if isinstance(obj, Literal):
+                    continue
+
+                # Nodes link to local objects by fragment and to anything
+                # else by URI, and show the titles of the local objects
+                linked = self.objects.get(unicode(obj))
+                parts.append(linked is not None)
+                if linked and linked.title:
+                    for title in linked.title:
+                        parts.extend(_get_term_key(title))
+
+                # ...and the pages they are on
+                if linked and self.page_size:
+                    parts.append(self._get_pages()[linked.id])
+
+        key = u'\x00'.join(unicode(part) for part in parts)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
 
     def _format_summary(self, rdf_obj, language):
         """
@@ -126,53 +639,80 @@ class HtmlConverter(object):
 
         return out
 
-    def _format_node(self, rdf_obj, language, include=None):
+    def _build_skeleton(self, rdf_obj):
+        """
+        Build the language independent part of a node. Links are
+        resolved here, while titles of local objects, predicate labels and
+        literals are left for _format_node.
+        """
+        # Links to nodes on other pages include the page
+        page = None
+        if self.page_size:
+            page = self._get_pages()[rdf_obj.id]
+
+        about_link, _, _ = self._get_link(RDF_ABOUT, self.skip_internal_links,
+                                          page)
+
+        attributes = []
+        for pred in sorted(rdf_obj.attributes.keys()):
+            obj_list = rdf_obj.attributes[pred]
+
+            attribute = {'pred': self._get_link(pred, self.skip_literal_links,
+                                                page)}
+            if obj_list and isinstance(obj_list[0], Literal):
+                # Indexed once and reused for every language
+                attribute['literals'] = index_literals(obj_list)
+            else:
+                links = []
+                for obj in obj_list:
+                    if isinstance(obj, URIRef):
+                        links.append(self._get_link(obj, self.skip_internal_links,
+                                                    page))
+                    elif isinstance(obj, BNode):
+                        links.append(self._get_local_link(obj, self.skip_internal_links,
+                                                          page))
+                attribute['links'] = links
+
+            attributes.append(attribute)
+
+        return {'obj': rdf_obj,
+                'about_link': about_link,
+                'attributes': attributes}
+
+    def _format_node(self, skeleton, language):
         """
         Returns a single node as a table with all:
         * Literals - formatted with the desired language
         * BNodes   - formatted as links
         * URIRefs  - formatted as links
         """
-        if not include:
-            include = sorted(rdf_obj.attributes.keys())
+        rdf_obj = skeleton['obj']
 
         attributes = []
         # Add the RDF id att the top
-        pred_link, pred_title = self._format_uriref(RDF_ABOUT, language, skip_local=self.skip_internal_links)
-        obj_link, obj_title = self._format_uriref(rdf_obj.id, language, skip_local=True)
         attributes.append({
-            'pred_link': pred_link,
+            'pred_link': skeleton['about_link'],
             'pred_title': 'About',
-            'objs': [{'title': obj_title,
-                      'link': obj_link}],
+            'objs': [{'title': rdf_obj.get_title(language),
+                      'link': rdf_obj.id}],
         })
 
-        for pred in sorted(include):
-            try:
-                obj_list = rdf_obj.attributes[pred]
-            except KeyError:
-                # Skip the desired attributes if they are not present
-                continue
-
-            pred_link, pred_title = self._format_uriref(pred, language, skip_local=self.skip_literal_links)
+        for attribute in skeleton['attributes']:
+            pred_link = attribute['pred'][0]
             # Try to resolve the predicate to a more human readable format
-            label = self._pred_res.resolve(pred_link, language)
-            if label:
-                pred_title = label
+            pred_title = self._pred_res.resolve(pred_link, language)
+            if not pred_title:
+                pred_title = self._get_title(attribute['pred'], language)
 
             objs = []
-            if obj_list and isinstance(obj_list[0], Literal):
-                literals = format_literal(obj_list, language, self.skip_literal_links)
+            if 'literals' in attribute:
+                literals = format_literal_index(attribute['literals'], language,
+                                                self.skip_literal_links)
                 objs.append({'title': u' '.join(literals)})
             else:
                 # Get the other objects and sort them based on their title
-                new_list = []
-                for obj in obj_list:
-                    if isinstance(obj, URIRef):
-                        new_list.append(self._format_uriref(obj, language, self.skip_internal_links))
-                    elif isinstance(obj, BNode):
-                        new_list.append(self._format_bnode(obj, language, self.skip_internal_links))
-
+                new_list = [(link[0], self._get_title(link, language))
+                            for link in attribute['links']]
                 new_list = sorted(new_list, key=lambda t: t[1])
 
                 for link, title in new_list:
@@ -189,14 +729,25 @@ class HtmlConverter(object):
         # Add show more button
         return attributes
 
-    def _format_uriref(self, uri_ref, language, skip_local=False):
+    def _get_title(self, link, language):
         """
-        Return the HTML representation of a URIRef
+        Get the title of a link returned by _get_link or _get_local_link
+        """
+        _, rdf_id, title = link
+        if rdf_id is not None:
+            return self.objects[rdf_id].get_title(language)
+        return title
+
+    def _get_link(self, uri_ref, skip_local=False, page=None):
+        """
+        Return the link of a URIRef together with the id of the local
+        object it points to, or a title if it points to something else.
+        Only the id is kept, since a catalog links to every dataset.
         """
         # Does it point to a local asset?
         local_ref = unicode(uri_ref)
         if local_ref in self.objects:
-            return self._format_bnode(uri_ref, language, skip_local)
+            return self._get_local_link(uri_ref, skip_local, page)
 
         # It seems that some URIRefs get normalized with a '<' and a '>'
         # at the start/end of the string.
@@ -210,36 +761,52 @@ class HtmlConverter(object):
         if norm[-1] == '/':
             norm = norm[:len(norm)-1]
 
-        return uri_ref, norm
+        return uri_ref, None, norm
 
-    def _format_bnode(self, bnode, language, skip_local=False):
+    def _get_local_link(self, bnode, skip_local=False, page=None):
         """
-        Return the HTML representation of a BNonde
+        Return the link of a BNode together with the id of the local
+        object it points to
         """
-        # Check if we can get a title for the bnode
         rdf_id = unicode(bnode)
 
-        link = self._get_fragment_link(rdf_id)
+        link = self._get_fragment_link(rdf_id, page)
         if link:
-            title = self.objects[rdf_id].get_title(language)
             if not skip_local:
-                return link, title
+                return link, rdf_id, None
             else:
-                return rdf_id, title
+                return rdf_id, rdf_id, None
 
-        return None, None
+        return None, None, None
 
-    def _get_fragment_link(self, rdf_id):
+    def _get_fragment_link(self, rdf_id, page=None):
         """
         Get a link to a file containing an RDF node. Returns none if the
         node could not be found in the current context
+        :param page: number of the page linked from, if the nodes are
+                     split between pages
         """
         try:
-            return '#' + self.objects[unicode(rdf_id)].fragment
-
+            rdf_obj = self.objects[unicode(rdf_id)]
         except KeyError:
             return None
 
+        link = '#' + rdf_obj.fragment
+        if page is not None:
+            target = self._get_pages()[rdf_obj.id]
+            if target != page:
+                link = get_link_file(get_page_name(self.name, target)) + link
+        return link
+
+
+def _get_term_key(term):
+    """
+    Get the parts of an RDF term that identify it in a fragment key
+    """
+    if isinstance(term, Literal):
+        return (u'literal', term, term.language, term.datatype)
+    return (term.__class__.__name__, term)
+
 
 # region Literal formatting
 
@@ -247,6 +814,14 @@ class HtmlConverter(object):
 LINK_REGEX = re.compile(r'(http://[ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789\-._~:/?#\[\]@!$&\'()*+,;=%%]+)')
 TO_WHITESPACE = re.compile(r'[_-]')
 
+# Catalogs repeat the same license and publisher texts over and over, so
+# we remember the most recently linkified literals
+LINK_CACHE_SIZE = 10000
+_link_cache = OrderedDict()
+
+# Watch mode converts several files at once in threads
+_link_cache_lock = threading.Lock()
+
 
 def format_literal(literals, language, skip_link=False):
     """
@@ -255,30 +830,42 @@ def format_literal(literals, language, skip_link=False):
     the literals without a language tag. Finally, return literals of
     another language if there are not better match
     """
-    same_lang = []
-    no_lang = []
-    other_lang = []
     if not literals:
         return ''
+    return format_literal_index(index_literals(literals), language,
+                                skip_link)
 
+
+def index_literals(literals):
+    """
+    Group the values of one or more Literals by language, so the best
+    match for any language can be found without scanning the literals
+    again. Values without a language tag are stored under None.
+    :return: dictionary of language -> list of values
+    """
+    index = {}
     for literal in literals:
-        if not skip_link:
-            value = _add_html_links(literal.value)
-        else:
-            value = literal.value
-        if literal.language == language:
-            same_lang.append(value)
-        elif not literal.language:
-            no_lang.append(value)
-        else:
-            other_lang.append(value)
+        index.setdefault(literal.language or None, []).append(literal.value)
+    return index
+
+
+def format_literal_index(index, language, skip_link=False):
+    """
+    Return the HTML representation of the literals in an index returned by
+    index_literals, see format_literal
+    """
+    if language in index:
+        selected = index[language]
+    elif None in index:
+        selected = index[None]
+    else:
+        selected = [value for values in index.itervalues()
+                    for value in values]
 
-    if same_lang:
-        return sorted(same_lang)
-    if no_lang:
-        return sorted(no_lang)
-    if other_lang:
-        return sorted(other_lang)
+    # Only the literals actually used are converted
+    if not skip_link:
+        selected = [_add_html_links(value) for value in selected]
+    return sorted(selected)
 
 
 def _add_html_links(string):
@@ -286,14 +873,35 @@ def _add_html_links(string):
     Find anything that looks like a hyperlink and convert it to an actual
     HTML link.
     """
-    matches = LINK_REGEX.findall(string)
-    for url in matches:
+    if 'http://' not in string:
+        return string
+
+    with _link_cache_lock:
+        try:
+            out = _link_cache.pop(string)
+        except KeyError:
+            out = _link_string(string)
+            if len(_link_cache) >= LINK_CACHE_SIZE:
+                _link_cache.popitem(last=False)
+        _link_cache[string] = out
+    return out
+
+
+def _link_string(string):
+    """
+    Convert all hyperlinks in a string to HTML links in a single pass
+    """
+    parts = []
+    pos = 0
+    for match in LINK_REGEX.finditer(string):
+        url = match.group(1)
+
         # There is a special case when the URL is entered between parenthesis.
         # We want to remove the last character if it's a closing parenthesis
         # and if the url is preceeded by the matching opening parenthesis.
         if url[-1] == ')':
-            char = _get_preceding_character(string, url)
-            if char and char == '(':
+            start = match.start(1)
+            if start > 0 and string[start - 1] == '(':
                 url = url[:-1]
 
         # If the last character is a ".", it's most likely used to end a
@@ -317,10 +925,13 @@ def _add_html_links(string):
         # We also want to remove underscores and such
         display_name = TO_WHITESPACE.sub(' ', display_name)
 
-        html_link = _make_link(url, display_name)
-        string = string.replace(url, html_link)
+        # Characters stripped from the url are kept as text
+        parts.append(string[pos:match.start(1)])
+        parts.append(_make_link(url, display_name))
+        pos = match.start(1) + len(url)
 
-    return string
+    parts.append(string[pos:])
+    return u''.join(parts)
 
 
 def _make_link(url, display_name):
@@ -329,14 +940,4 @@ def _make_link(url, display_name):
     """
     return u'<a href=%s target="_blank">%s</a>' % (url, display_name)
 
-
-def _get_preceding_character(string, sub_string):
-    """
-    Search a string for a substring and return the single character before the
-    sub string
-    """
-    pos = string.find(sub_string) - 1
-    if pos != -1:
-        return string[pos]
-
 # endregion
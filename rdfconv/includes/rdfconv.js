@@ -1,19 +1,89 @@
+// Attribute tables of pages converted with --lazy-details, by file
+var details = {};
+
+// Build the table of a node from the JSON file of its page, if it
+// hasn't been built yet, and call done once it has
+function loadDetails(node, done) {
+    var info = node.children('.full_info');
+    var file = info.attr('data-details');
+    if (!file || info.children('table').length) {
+	done();
+	return;
+    }
+
+    var request = details[file];
+    if (!request) {
+	request = details[file] = $.getJSON(file);
+    }
+    request.done(function(nodes) {
+	info.children('.details_error').remove();
+	if (!info.children('table').length) {
+	    info.append(buildTable(nodes[node.attr('id')] || []));
+	}
+	done();
+    }).fail(function() {
+	// Forget the failed request, so the file is requested again the
+	// next time a node is opened
+	if (details[file] === request) {
+	    delete details[file];
+	}
+	if (!info.children('.details_error').length) {
+	    info.append($('<p class="details_error">').text(
+		'The details could not be loaded, please try again.'));
+	}
+	done();
+    });
+}
+
+// Build the same table as node.html from the rows of a node
+function buildTable(rows) {
+    var tbody = $('<tbody>');
+    $.each(rows, function(i, row) {
+	var objs = $('<td>');
+	$.each(row.slice(2), function(j, obj) {
+	    if ($.isArray(obj)) {
+		objs.append($('<a>').attr('href', obj[0]).text(obj[1] || ''),
+			    '<br />');
+	    } else {
+		objs.append(obj);
+	    }
+	});
+	tbody.append($('<tr>').append(
+	    $('<td>').append($('<a>').attr('href', row[0]).text(row[1] || '')),
+	    objs));
+    });
+    return $('<table>').append(tbody);
+}
+
+// Show the table of the node linked to by a hash
+function showTarget(hash) {
+    var target = $(hash);
+    target = target.length ? target : $('[name=' + hash.slice(1) +']');
+    if (target.length && !target.children('.full_info').is(':visible')) {
+	target.children('.show_more').click();
+    }
+    return target;
+}
+
 $(document).ready(function() {
     $('.rdf_obj .show_more').click(function() {
 	var link = $(this);
-	table = $(this).siblings('.full_info');
-	table.slideToggle(400, function() {
-	    if (table.is(':visible')) {
-		link.html('Show less');
-	    } else {
-		link.html('Show more');
-	    }
-	})
+	var table = $(this).siblings('.full_info');
+	loadDetails(link.parent(), function() {
+	    table.slideToggle(400, function() {
+		if (table.is(':visible')) {
+		    link.html('Show less');
+		} else {
+		    link.html('Show more');
+		}
+	    })
+	});
 
     });
 
-    $(function() {
-      $('a[href*=#]:not([href=#])').click(function() {
+    // Links within the page are followed by scrolling, also for the
+    // links of tables built later
+    $(document).on('click', 'a[href*="#"]:not([href="#"])', function() {
 	if (location.pathname.replace(/^\//,'') == this.pathname.replace(/^\//,'') && location.hostname == this.hostname) {
 	  var target = $(this.hash);
 	  target = target.length ? target : $('[name=' + this.hash.slice(1) +']');
@@ -23,15 +93,18 @@ $(document).ready(function() {
 	    }, 400);
 
 	    location.hash = this.hash
-	    if (!target.children('.full_info').is(':visible')) {
-		setTimeout(function() {
-		    target.children('.show_more').click();
-		}, 400);
-	    }
+	    var hash = this.hash;
+	    setTimeout(function() {
+		showTarget(hash);
+	    }, 400);
 
 	    return false;
 	  }
 	}
-      });
     });
+
+    // Links from other pages
+    if (location.hash.length > 1) {
+	showTarget(location.hash);
+    }
 });
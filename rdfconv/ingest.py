@@ -0,0 +1,436 @@
+"""
+Module for reading RDF files straight into the dictionaries used by the
+converter, without storing the triples in an rdflib Graph first.
+"""
+import os
+import re
+import hashlib
+from xml.sax import SAXParseException
+
+import rdflib
+from rdflib.exceptions import ParserError
+from rdflib.parser import Parser, create_input_source
+from rdflib.plugin import PluginException
+from rdflib.term import URIRef, BNode, Literal
+
+RDF_XML = 'xml'
+N_TRIPLES = 'nt'
+TURTLE = 'turtle'
+JSON_LD = 'json-ld'
+
+# Formats that can be read, by their rdflib names
+INPUT_FORMATS = [RDF_XML, N_TRIPLES, TURTLE, JSON_LD]
+
+# Formats of the common file extensions
+EXTENSIONS = {
+    '.rdf': RDF_XML,
+    '.xml': RDF_XML,
+    '.owl': RDF_XML,
+    '.nt': N_TRIPLES,
+    '.ttl': TURTLE,
+    '.jsonld': JSON_LD,
+    '.json': JSON_LD,
+}
+
+# Most rounds of refining the signatures of blank nodes with those of
+# their neighbours. Each round tells apart blank nodes that differ one
+# step further away, refining stops early once a round doesn't.
+BNODE_ROUNDS = 8
+
+# A single line of N-Triples. Subjects are IRIs or blank nodes, objects
+# are IRIs, blank nodes or literals with a language or a datatype.
+_IRI = r'<([^>]*)>'
+_BNODE = r'_:([A-Za-z0-9_](?:[A-Za-z0-9_.\-]*[A-Za-z0-9_\-])?)'
+_LITERAL = (r'"((?:[^"\\]|\\.)*)"'
+            r'(?:@([a-zA-Z]+(?:-[a-zA-Z0-9]+)*)|\^\^<([^>]*)>)?')
+TRIPLE_REGEX = re.compile(
+    r'[ \t]*(?:%s|%s)[ \t]*%s[ \t]*(?:%s|%s|%s)[ \t]*\.[ \t]*(?:#.*)?$'
+    % (_IRI, _BNODE, _IRI, _IRI, _BNODE, _LITERAL))
+
+ESCAPE_REGEX = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ESCAPES = {'t': u'\t', 'b': u'\b', 'n': u'\n', 'r': u'\r', 'f': u'\f',
+           '"': u'"', "'": u"'", '\\': u'\\'}
+
+
+class Error(Exception):
+    """
+    Base class for exceptions in this module
+    """
+    pass
+
+
+class FormatError(Error):
+    """
+    Raised when a file can't be read in the requested format
+    """
+    pass
+
+
+class TripleSink(object):
+    """
+    Target for an rdflib parser, grouping the triples by subject and
+    predicate as they are parsed. Only the prefix bindings are kept in an
+    rdflib Graph, since they are needed to shorten URIs.
+    """
+
+    def __init__(self):
+        # Dictionary of subject -> predicate -> list of objects
+        self.subjects = {}
+
+        # Languages of all literals
+        self.languages = set()
+
+        # Graph without triples, holding the prefixes
+        self._namespaces = rdflib.Graph()
+        self.namespace_manager = self._namespaces.namespace_manager
+
+        # Predicate -> unicode key. The keys are shared by all subjects.
+        self._predicates = {}
+
+        # URIs and literals repeated across subjects, such as types,
+        # publishers and licenses, are only stored once
+        self._terms = {}
+
+    def add(self, triple):
+        """
+        Add a triple, called by the parser
+        """
+        subj, pred, obj = triple
+        if not isinstance(obj, BNode):
+            obj = self._terms.setdefault(obj, obj)
+
+        key = self._predicates.get(pred)
+        if key is None:
+            key = self._predicates[pred] = pred.toPython()
+
+        attributes = self.subjects.get(subj)
+        if attributes is None:
+            attributes = self.subjects[subj] = {}
+
+        objs = attributes.get(key)
+        if objs is None:
+            attributes[key] = [obj]
+        else:
+            objs.append(obj)
+
+        if isinstance(obj, Literal) and obj.language:
+            self.languages.add(obj.language)
+
+    def bind(self, prefix, namespace, override=True):
+        """
+        Bind a prefix to a namespace, called by the parser
+        """
+        self._namespaces.bind(prefix, namespace, override=override)
+
+    def finish(self):
+        """
+        Called once all triples have been parsed
+        """
+        self.remove_duplicates()
+
+    def remove_duplicates(self):
+        """
+        Remove triples that were stated more than once. This is done once
+        all triples have been parsed, since a catalog can have thousands
+        of datasets.
+        """
+        for attributes in self.subjects.itervalues():
+            for pred, objs in attributes.items():
+                if len(objs) > 1 and len(set(objs)) < len(objs):
+                    seen = set()
+                    attributes[pred] = [obj for obj in objs
+                                        if not (obj in seen or seen.add(obj))]
+
+    def rename_bnodes(self):
+        """
+        Name the blank nodes after the triples they are part of, so they
+        get the same ids every time a file is parsed. The parser names
+        them randomly, which would change the output every time the file
+        is converted.
+
+        This is done for every file, not only with --stable, since the
+        fragment cache is keyed by the triples of the nodes, blank node
+        names included. Parsed files are cached with the new names, so
+        the cost is paid once per input.
+        """
+        neighbours = {}
+        for subj, attributes in self.subjects.iteritems():
+            for pred, objs in attributes.iteritems():
+                for obj in objs:
+                    if isinstance(subj, BNode):
+                        neighbours.setdefault(subj, []).append(
+                            (False, pred, obj))
+                    if isinstance(obj, BNode):
+                        neighbours.setdefault(obj, []).append(
+                            (True, pred, subj))
+
+        digests = None
+        for _ in xrange(BNODE_ROUNDS):
+            refined = {}
+            for bnode, triples in neighbours.iteritems():
+                lines = [get_signature_line(incoming, pred, term,
+                                            digests and digests.get(term))
+                         for incoming, pred, term in triples]
+                refined[bnode] = get_signature_digest(lines)
+            if digests is not None and \
+                    len(set(refined.itervalues())) <= \
+                    len(set(digests.itervalues())):
+                break
+            digests = refined
+
+        bnodes = dict((bnode, BNode(name)) for bnode, name
+                      in iter_bnode_names(sorted((digest, bnode)
+                                                 for bnode, digest
+                                                 in (digests or {})
+                                                 .iteritems())))
+
+        if not bnodes:
+            return
+
+        for subj in [subj for subj in self.subjects if subj in bnodes]:
+            self.subjects[bnodes[subj]] = self.subjects.pop(subj)
+        for attributes in self.subjects.itervalues():
+            for objs in attributes.itervalues():
+                for i, obj in enumerate(objs):
+                    if isinstance(obj, BNode):
+                        objs[i] = bnodes[obj]
+
+
+def get_term_signature(term, digest=None):
+    """
+    Get a string identifying a term in the signature of a blank node
+    :param digest: digest of the signature of the term, if it is a blank
+    node and the signatures are being refined
+    """
+    if isinstance(term, BNode):
+        return u'_:' + digest if digest else u'_'
+    if isinstance(term, Literal):
+        return term.n3()
+    return u'<%s>' % term
+
+
+def get_signature_line(incoming, pred, term, digest=None):
+    """
+    Get the line of a triple in the signature of a blank node
+    :param incoming: whether the blank node is the object of the triple
+    :param pred: predicate of the triple
+    :param term: the other term of the triple
+    :param digest: digest of the signature of the other term, see
+    get_term_signature
+    """
+    if incoming:
+        return u'< %s %s' % (get_term_signature(term, digest), pred)
+    return u'> %s %s' % (pred, get_term_signature(term, digest))
+
+
+def get_signature_digest(lines):
+    """
+    Get the digest of the signature of a blank node
+    :param lines: one line per triple the blank node is part of
+    """
+    signature = u'\n'.join(sorted(lines)).encode('utf-8')
+    return hashlib.md5(signature).hexdigest()
+
+
+def iter_bnode_names(digests):
+    """
+    Name blank nodes after the digests of their signatures
+    :param digests: sorted tuples of digest and blank node
+    :return: iterator of tuples of blank node and name
+    """
+    # Blank nodes with the same refined signature have the same triples,
+    # and so do their neighbours, as far as BNODE_ROUNDS steps away. Which
+    # of them gets which number doesn't change the output.
+    previous = None
+    count = 0
+    for digest, bnode in digests:
+        if digest == previous:
+            count += 1
+        else:
+            previous = digest
+            count = 0
+        if count:
+            digest = hashlib.md5('%s-%d' % (digest, count)).hexdigest()
+        yield bnode, 'N' + digest
+
+
+def guess_format(filename):
+    """
+    Guess the format of an RDF file from its extension, or from its
+    first characters if the extension is unknown
+    :param filename: path of the file
+    :return: one of INPUT_FORMATS
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+
+    with open(filename, 'rb') as file_obj:
+        start = file_obj.read(1024)
+
+    # N-Triples and Turtle files can start with comments and blank lines
+    lines = [line.strip() for line in start.split('\n')]
+    lines = [line for line in lines if line and not line.startswith('#')]
+    start = lines[0] if lines else ''
+
+    if start.startswith(('{', '[')):
+        return JSON_LD
+    if start.startswith(('@prefix', '@base', 'PREFIX', 'BASE')):
+        return TURTLE
+    if TRIPLE_REGEX.match(start):
+        return N_TRIPLES
+    return RDF_XML
+
+
+def parse_file(filename, rdf_format=None, sink=None):
+    """
+    Parse an RDF file
+    :param filename: path of the file
+    :param rdf_format: one of INPUT_FORMATS, guessed if omitted
+    :param sink: TripleSink to add the triples to, a new one if omitted
+    :return: the TripleSink holding the parsed triples
+    """
+    if not rdf_format:
+        rdf_format = guess_format(filename)
+
+    if sink is None:
+        sink = TripleSink()
+    # The Turtle parser raises a SyntaxError and the JSON-LD parser a
+    # ValueError
+    try:
+        if rdf_format == N_TRIPLES:
+            with open(filename, 'rb') as file_obj:
+                parse_ntriples(file_obj, sink, filename)
+        elif rdf_format in (TURTLE, JSON_LD):
+            _parse_graph(filename, rdf_format, sink)
+        else:
+            _parse_sink(filename, rdf_format, sink)
+    except (SAXParseException, ParserError, SyntaxError, ValueError) as err:
+        raise FormatError('Unable to read %s as %s. %s'
+                          % (filename, rdf_format, err))
+
+    sink.finish()
+    return sink
+
+
+def _get_parser(rdf_format):
+    """
+    Get the rdflib parser of a format
+    """
+    try:
+        return rdflib.plugin.get(rdf_format, Parser)()
+    except PluginException:
+        if rdf_format == JSON_LD:
+            raise FormatError('Reading JSON-LD requires rdflib-jsonld to be '
+                              'installed')
+        raise FormatError('Unknown input format %s' % rdf_format)
+
+
+def _parse_sink(filename, rdf_format, sink):
+    """
+    Parse a file with an rdflib parser writing straight to the sink
+    """
+    parser = _get_parser(rdf_format)
+    source = create_input_source(source=filename, format=rdf_format)
+    try:
+        parser.parse(source, sink)
+    finally:
+        if source.auto_close:
+            source.close()
+
+
+def _parse_graph(filename, rdf_format, sink):
+    """
+    Parse a file with an rdflib parser that needs a real Graph, like the
+    Turtle and JSON-LD parsers, and copy the triples to the sink
+    """
+    _get_parser(rdf_format)
+    graph = rdflib.Graph()
+    graph.parse(filename, format=rdf_format)
+    for prefix, namespace in graph.namespaces():
+        sink.bind(prefix, namespace, override=False)
+    for triple in graph:
+        sink.add(triple)
+
+
+def parse_ntriples(lines, sink, name='<input>'):
+    """
+    Parse N-Triples line by line. This is considerably faster than the
+    rdflib parsers, since each line is matched by a single regular
+    expression.
+    :param lines: iterable of lines, such as a file
+    :param sink: TripleSink to add the triples to
+    :param name: name of the input used in error messages
+    """
+    # Most IRIs are repeated, so each is only turned into a term once
+    iris = {}
+    bnodes = {}
+
+    for number, line in enumerate(lines, 1):
+        line = line.decode('utf-8').strip()
+        if not line or line.startswith('#'):
+            continue
+
+        match = TRIPLE_REGEX.match(line)
+        if not match:
+            raise FormatError('Invalid N-Triples on line %d of %s'
+                              % (number, name))
+        (subj_iri, subj_bnode, pred, obj_iri, obj_bnode,
+         literal, language, datatype) = match.groups()
+
+        if subj_iri is not None:
+            subj = _get_iri(iris, subj_iri)
+        else:
+            subj = _get_bnode(bnodes, subj_bnode)
+
+        if obj_iri is not None:
+            obj = _get_iri(iris, obj_iri)
+        elif obj_bnode is not None:
+            obj = _get_bnode(bnodes, obj_bnode)
+        else:
+            if '\\' in literal:
+                literal = ESCAPE_REGEX.sub(_unescape, literal)
+            if datatype is not None:
+                obj = Literal(literal, datatype=_get_iri(iris, datatype))
+            else:
+                obj = Literal(literal, lang=language)
+
+        sink.add((subj, _get_iri(iris, pred), obj))
+
+
+def _get_iri(iris, iri):
+    """
+    Get the URIRef of an IRI from an N-Triples line
+    """
+    term = iris.get(iri)
+    if term is None:
+        if '\\' in iri:
+            term = URIRef(ESCAPE_REGEX.sub(_unescape, iri))
+        else:
+            term = URIRef(iri)
+        iris[iri] = term
+    return term
+
+
+def _get_bnode(bnodes, label):
+    """
+    Get the BNode of a blank node label from an N-Triples file
+    """
+    term = bnodes.get(label)
+    if term is None:
+        term = bnodes[label] = BNode(label)
+    return term
+
+
+def _unescape(match):
+    """
+    Replace an escape sequence of an N-Triples string
+    """
+    short, long_, char = match.groups()
+    if short:
+        return unichr(int(short, 16))
+    if long_:
+        # unichr can't handle code points outside of the BMP on narrow
+        # Python builds
+        return ('\\U' + long_).decode('unicode-escape')
+    return ESCAPES.get(char, char)
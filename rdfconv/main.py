@@ -2,50 +2,310 @@
 Main entry point
 """
 
+import os
+import copy
 import argparse
 import logging
 import sys
+import time
+import threading
+import multiprocessing
 from rdfconv.converter import RDFtoHTMLConverter, LanguageError
+from rdfconv.ingest import FormatError, INPUT_FORMATS
+from rdfconv.cache import VocabularyCache, FragmentCache, CatalogCache, \
+    DEFAULT_TTL
+from rdfconv.manifest import BuildManifest
+from rdfconv.renderers import get_renderer, RENDERERS, DEFAULT_RENDERER
+from rdfconv.compress import check_encodings, CompressionError, ENCODINGS
+from rdfconv.predicate import get_shared_resolver, \
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
 import pyinotify
 
 
+# Seconds a watched file must be left alone before it is converted
+DEFAULT_DEBOUNCE = 2.0
+
+# Events sent when a file has been written or moved into place
+WATCH_EVENTS = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+
+
 class EventHandler(pyinotify.ProcessEvent):
     """
     Class handling notifications when a watched file is changed
     """
-    def __init__(self, output_folder, languages):
+    def __init__(self, input_files, queue):
         super(EventHandler, self).__init__()
-        self.output_folder = output_folder
-        self.languages = languages
+        self.input_files = set(os.path.abspath(path) for path in input_files)
+        self.queue = queue
 
     def process_default(self, event):
-        logging.info('%s changed', event.path)
-        run(event.path, self.output_folder, self.languages)
+        # The parent directories are watched, so skip other files
+        if event.pathname in self.input_files:
+            self.queue.add(event.pathname)
+
+
+class ConversionQueue(object):
+    """
+    Queue of files waiting to be converted. Changes to a file are
+    coalesced until the file has been left alone for a while, and a file
+    is never converted by two workers at once.
+    """
+
+    def __init__(self, convert, delay=DEFAULT_DEBOUNCE, workers=1):
+        self.convert = convert
+        self.delay = delay
+
+        # Path -> time when the file should be converted
+        self._pending = {}
+
+        # Files currently being converted
+        self._running = set()
+
+        self._condition = threading.Condition()
+
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def add(self, path):
+        """
+        Queue a file, postponing it if it is already queued
+        """
+        with self._condition:
+            self._pending[path] = time.time() + self.delay
+            self._condition.notify_all()
+
+    def _next(self):
+        """
+        Wait for the next file that is due and not being converted
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                due = [(when, path) for path, when in self._pending.items()
+                       if path not in self._running]
+                if due:
+                    when, path = min(due)
+                    if when <= now:
+                        del self._pending[path]
+                        self._running.add(path)
+                        return path
+                    self._condition.wait(when - now)
+                else:
+                    self._condition.wait()
+
+    def _work(self):
+        """
+        Convert queued files until the process exits
+        """
+        while True:
+            path = self._next()
+            try:
+                logging.info('%s changed', path)
+                self.convert(path)
+            except Exception:  # pylint: disable=W0703
+                # Keep watching even if a conversion fails
+                logging.exception('Unable to convert %s', path)
+            finally:
+                with self._condition:
+                    self._running.discard(path)
+                    self._condition.notify_all()
+
+
+class Options(object):
+    """
+    Options of a conversion, see run. The defaults are those of the
+    command line, see create_options.
+    """
 
+    def __init__(self, **options):
+        # Shared between conversions, so vocabularies stay loaded. The
+        # shared resolver is used if omitted.
+        self.pred_res = None
 
-def run(input_file, output_folder, languages='all'):
+        # Renderer, see rdfconv.renderers. The default one if omitted.
+        self.renderer = None
+
+        # Caches of rendered nodes and of parsed files, see rdfconv.cache
+        self.fragment_cache = None
+        self.catalog_cache = None
+
+        # Format of the input files, guessed if omitted
+        self.input_format = None
+
+        # Convert files even if they haven't changed since they were last
+        # converted
+        self.force = False
+
+        # See RDFtoHTMLConverter
+        self.stream = False
+        self.language_jobs = 1
+        self.shards = 1
+        self.stable = False
+        self.disk_store = False
+        self.page_size = 0
+        self.lazy_details = False
+        self.compress = []
+        self.compress_jobs = None
+
+        for name, value in options.iteritems():
+            if not hasattr(self, name):
+                raise TypeError('Unknown option %s' % name)
+            setattr(self, name, value)
+
+
+def run(input_file, output_folder, languages='all', options=None):
     """
-    Run the RDF converter
+    Run the RDF converter. Files that haven't changed since they were
+    last converted are skipped, unless the force option is set.
+    :param options: options of the conversion, the defaults if omitted
+    :return: None if the file was converted, otherwise an error message
     """
+    if options is None:
+        options = Options()
+    pred_res = options.pred_res or get_shared_resolver()
+
     try:
+        rdf_conv = RDFtoHTMLConverter(languages, pred_res=pred_res)
+        rdf_conv.stream_output = options.stream
+        rdf_conv.renderer = options.renderer
+        rdf_conv.language_jobs = options.language_jobs
+        rdf_conv.shards = options.shards
+        rdf_conv.fragment_cache = options.fragment_cache
+        rdf_conv.stable_output = options.stable
+        rdf_conv.catalog_cache = options.catalog_cache
+        rdf_conv.disk_store = options.disk_store
+        rdf_conv.page_size = options.page_size
+        rdf_conv.lazy_details = options.lazy_details
+        rdf_conv.compress = options.compress
+        rdf_conv.compress_jobs = options.compress_jobs
+
+        manifest = BuildManifest(output_folder)
+        record = manifest.create_record(input_file, languages, pred_res,
+                                        rdf_conv.get_output_options(),
+                                        options.input_format)
+        if not options.force and manifest.is_current(input_file, record):
+            logging.info('Skipping %s, nothing has changed', input_file)
+            return
+
         logging.info('Converting %s', input_file)
-        rdf_conv = RDFtoHTMLConverter(languages)
-        rdf_conv.load_file(input_file)
-        rdf_conv.output_html(output_folder)
+        try:
+            rdf_conv.load_file(input_file, options.input_format,
+                               record['hash'])
+            outputs = rdf_conv.output_html(output_folder)
+        finally:
+            rdf_conv.close()
+
+        # Vocabularies may have been downloaded during the conversion
+        record['vocabularies'] = pred_res.get_generation()
+        manifest.update(input_file, record, outputs)
         logging.info('Finished converting %s', input_file)
-    except LanguageError as err:
+    except (LanguageError, FormatError) as err:
         logging.error('Skipped file %s: %s', input_file, err)
+        return str(err)
+
+
+def run_file(input_file, output_folder, languages='all', options=None):
+    """
+    Run the RDF converter on a single file of several, see run. Any
+    error is reported instead of raised, since a single broken file
+    shouldn't stop the other conversions.
+    :return: None if the file was converted, otherwise an error message
+    """
+    try:
+        return run(input_file, output_folder, languages, options)
+    except Exception as err:  # pylint: disable=W0703
+        logging.exception('Unable to convert %s', input_file)
+        return str(err)
+
+
+# Command line arguments and options of the worker processes used by
+# run_parallel
+_worker_args = None
+_worker_options = None
+
+
+def _init_worker(args):
+    """
+    Setup a worker process. Each worker keeps its own resolver, so
+    vocabularies stay loaded between the files it converts.
+    """
+    global _worker_args, _worker_options  # pylint: disable=W0603
+    _worker_args = args
+    _worker_options = create_options(args)
+
+
+def _run_worker(input_file):
+    """
+    Convert a single file in a worker process
+    :return: tuple of the file and None or an error message
+    """
+    args = _worker_args
+    error = run_file(input_file, args.output, args.languages.split(','),
+                     _worker_options)
+    return input_file, error
 
 
-def watch(input_files, output_folder, languages='all'):
+def run_parallel(input_files, args):
     """
-    Setup watching of given files
+    Run the RDF converter on several files in parallel
+    :param input_files: files to convert
+    :param args: parsed command line arguments
+    :return: list of tuples of files that failed and their error messages
     """
-    handler = EventHandler(output_folder, languages)
+    # Avoid the workers racing to create the output folder
+    if not os.path.exists(args.output):
+        os.mkdir(args.output)
+
+    pool = multiprocessing.Pool(args.jobs, _init_worker, (args,))
+    try:
+        results = pool.map(_run_worker, input_files, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [(input_file, error) for input_file, error in results if error]
+
+
+def watch(input_files, output_folder, languages='all', options=None,
+          workers=1, delay=DEFAULT_DEBOUNCE):
+    """
+    Setup watching of given files. The resolver and renderer are kept
+    between conversions, so vocabularies stay loaded.
+    :param options: options of the conversions, see run
+    :param workers: number of files converted at once
+    :param delay: seconds a file must be left alone before it is converted
+    """
+    options = copy.copy(options) if options else Options()
+    if not options.pred_res:
+        options.pred_res = get_shared_resolver()
+
+    # Processes forked by one conversion would inherit the locks held by
+    # the others, so like with --jobs the languages and shards of a file
+    # are rendered, and its variants compressed, in the converting thread
+    if workers > 1:
+        options.language_jobs = 1
+        options.shards = 1
+        options.compress_jobs = 1
+
+    def convert(input_file):
+        """
+        Convert a changed file
+        """
+        run(input_file, output_folder, languages, options)
+
+    queue = ConversionQueue(convert, delay, workers)
+    handler = EventHandler(input_files, queue)
     watch_manager = pyinotify.WatchManager()
     notifier = pyinotify.Notifier(watch_manager, handler)
-    for input_file in input_files:
-        watch_manager.add_watch(input_file, pyinotify.IN_MODIFY)
+
+    # Watch the directories rather than the files, since editors and
+    # rsync often replace a file by moving a new one into place
+    directories = set(os.path.dirname(os.path.abspath(path))
+                      for path in input_files)
+    for directory in directories:
+        watch_manager.add_watch(directory, WATCH_EVENTS)
     notifier.loop()
 
 
@@ -62,6 +322,9 @@ def main():
                         help='DCAT file(s)')
     parser.add_argument('output', metavar='OUTPUT_DIR', type=str,
                         help='Output directory')
+    parser.add_argument('--input-format', choices=INPUT_FORMATS,
+                        help='Format of the input files. If omitted it is '
+                             'guessed from the file extension and content.')
     parser.add_argument('--languages', type=str, default='all',
                         help='Languages (on ISO-369-* format) to generate '
                              'separated by comma (,). If omitted all '
@@ -69,6 +332,83 @@ def main():
     parser.add_argument('--watch', action='store_true', help='Watch input '
                         'files for changes and run the conversion when a '
                         'change occurs.')
+    parser.add_argument('--jobs', metavar='N', type=int, default=1,
+                        help='Number of files to convert in parallel.')
+    parser.add_argument('--debounce', metavar='SECONDS', type=float,
+                        default=DEFAULT_DEBOUNCE,
+                        help='Time a watched file must be left unchanged '
+                             'before it is converted.')
+    parser.add_argument('--language-jobs', metavar='N', type=int, default=1,
+                        help='Number of languages of a file to render in '
+                             'parallel. Not used together with --jobs.')
+    parser.add_argument('--shards', metavar='N', type=int, default=1,
+                        help='Split the nodes of each page between N '
+                             'processes. Not used together with --jobs.')
+    parser.add_argument('--page-size', metavar='N', type=int, default=0,
+                        help='Split the nodes of each file between pages '
+                             'of at most N nodes, listed on an index page. '
+                             'Not used together with --shards.')
+    parser.add_argument('--lazy-details', action='store_true',
+                        help='Only write the summaries of the nodes to the '
+                             'pages. Their tables are written to a JSON file '
+                             'next to each page and built when shown.')
+    parser.add_argument('--compress', metavar='ENCODINGS',
+                        help='Also write the output files compressed with '
+                             'each of a comma separated list of encodings, '
+                             'for the web server to serve as they are. '
+                             'Available encodings: %s. brotli requires '
+                             'brotli to be installed.' % ', '.join(ENCODINGS))
+    parser.add_argument('--force', action='store_true',
+                        help='Convert all files, even those that have not '
+                             'changed since they were last converted.')
+    parser.add_argument('--stable', action='store_true',
+                        help='Date the pages with the modification time of '
+                             'the input file and only replace output files '
+                             'whose content changed.')
+    parser.add_argument('--disk-store', action='store_true',
+                        help='Keep the parsed files in a temporary SQLite '
+                             'database instead of in memory, to convert '
+                             'files larger than the available memory.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Write the HTML one node at a time to keep '
+                             'memory usage low for large files.')
+    parser.add_argument('--renderer', choices=sorted(RENDERERS),
+                        default=DEFAULT_RENDERER,
+                        help='Renderer used to generate the HTML. The django '
+                             'renderer requires Django to be installed.')
+    parser.add_argument('--cache-dir', metavar='CACHE_DIR',
+                        help='Directory used to cache downloaded '
+                             'vocabularies, rendered nodes and parsed files '
+                             'between runs. Defaults to ~/.cache/rdf-to-html')
+    parser.add_argument('--cache-ttl', metavar='SECONDS', type=int,
+                        default=DEFAULT_TTL,
+                        help='Time before a cached vocabulary is '
+                             'revalidated. Defaults to one week.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not cache downloaded vocabularies '
+                             'between runs.')
+    parser.add_argument('--no-fragment-cache', action='store_true',
+                        help='Render every node instead of reusing the '
+                             'nodes that are unchanged since the last '
+                             'run.')
+    parser.add_argument('--no-catalog-cache', action='store_true',
+                        help='Parse every file instead of reusing the '
+                             'parsed content of unchanged files.')
+    parser.add_argument('--connect-timeout', metavar='SECONDS', type=float,
+                        default=DEFAULT_CONNECT_TIMEOUT,
+                        help='Time to wait for a connection when '
+                             'downloading a vocabulary.')
+    parser.add_argument('--read-timeout', metavar='SECONDS', type=float,
+                        default=DEFAULT_READ_TIMEOUT,
+                        help='Time to wait for data when downloading a '
+                             'vocabulary.')
+    parser.add_argument('--offline', action='store_true',
+                        help='Never download vocabularies. Predicates are '
+                             'only resolved using the bundled vocabularies '
+                             'and those in VOCABULARY_DIR.')
+    parser.add_argument('--vocabulary-dir', metavar='VOCABULARY_DIR',
+                        help='Directory with vocabulary snapshots used in '
+                             'offline mode, overriding the bundled ones.')
     parser.add_argument('--verbose', action='store_true',
                         help='Set log level to INFO instead of WARNING')
     parser.add_argument('--log-file', metavar='LOG_FILE',
@@ -81,11 +421,93 @@ def main():
 
     langs = args.languages.split(',')
 
+    # Split here, so the worker processes get the list
+    args.compress = args.compress.split(',') if args.compress else []
+    try:
+        check_encodings(args.compress)
+    except CompressionError as err:
+        parser.error(str(err))
+
     if args.watch:
-        watch(args.dcat_files, args.output, langs)
+        watch(args.dcat_files, args.output, langs, create_options(args),
+              args.jobs, args.debounce)
+        return
+
+    if args.jobs > 1:
+        errors = run_parallel(args.dcat_files, args)
     else:
+        options = create_options(args)
+        errors = []
         for dcat_file in args.dcat_files:
-            run(dcat_file, args.output, langs)
+            error = run_file(dcat_file, args.output, langs, options)
+            if error:
+                errors.append((dcat_file, error))
+
+    if errors:
+        logging.error('Failed to convert %d of %d files:\n\t%s',
+                      len(errors), len(args.dcat_files),
+                      '\n\t'.join('%s: %s' % error for error in errors))
+        sys.exit(1)
+
+
+def create_options(args):
+    """
+    Get the options of the conversions described by the command line
+    arguments, see Options
+    """
+    return Options(pred_res=create_resolver(args),
+                   renderer=get_renderer(args.renderer),
+                   fragment_cache=create_fragment_cache(args),
+                   catalog_cache=create_catalog_cache(args),
+                   input_format=args.input_format,
+                   force=args.force,
+                   stream=args.stream,
+                   language_jobs=args.language_jobs,
+                   shards=args.shards,
+                   stable=args.stable,
+                   disk_store=args.disk_store,
+                   page_size=args.page_size,
+                   lazy_details=args.lazy_details,
+                   compress=args.compress)
+
+
+def create_resolver(args):
+    """
+    Get the predicate resolver described by the command line arguments
+    """
+    vocabulary_cache = None
+    if not args.no_cache and not args.offline:
+        vocabulary_cache = VocabularyCache(args.cache_dir, args.cache_ttl)
+    return get_shared_resolver(vocabulary_cache,
+                               connect_timeout=args.connect_timeout,
+                               read_timeout=args.read_timeout,
+                               offline=args.offline,
+                               vocabulary_dir=args.vocabulary_dir)
+
+
+def create_fragment_cache(args):
+    """
+    Get the cache of rendered nodes described by the command line
+    arguments
+    """
+    if args.no_fragment_cache:
+        return None
+    cache_dir = None
+    if args.cache_dir:
+        cache_dir = os.path.join(args.cache_dir, 'fragments')
+    return FragmentCache(cache_dir)
+
+
+def create_catalog_cache(args):
+    """
+    Get the cache of parsed files described by the command line arguments
+    """
+    if args.no_catalog_cache:
+        return None
+    cache_dir = None
+    if args.cache_dir:
+        cache_dir = os.path.join(args.cache_dir, 'catalogs')
+    return CatalogCache(cache_dir)
 
 
 def setup_logging(verbose, log_file):
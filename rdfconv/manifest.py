@@ -0,0 +1,141 @@
+"""
+Module containing the build manifest, which records how the files in an
+output directory were converted so unchanged inputs can be skipped.
+"""
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import tempfile
+
+from rdfconv import __version__
+
+# The manifest is written to the output directory, which is usually
+# served as it is. Apache refuses to serve files starting with .ht by
+# default, and the manifest holds the absolute paths of the inputs.
+MANIFEST_NAME = '.htrdf-to-html-manifest.json'
+LOCK_NAME = MANIFEST_NAME + '.lock'
+
+# Size of the chunks input files are hashed in
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_file_hash(path):
+    """
+    Get a hash of the content of a file
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildManifest(object):
+    """
+    Class representing the manifest of an output directory. For each input
+    file it records the hash of its content, the languages, the options
+    affecting the output, the converter version and the generation of the
+    vocabularies it was converted with, together with the files written.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+
+    def create_record(self, input_file, languages, pred_res, options=None,
+                      input_format=None):
+        """
+        Describe how an input file is about to be converted
+        :param input_file: path of the RDF file
+        :param languages: languages to convert to
+        :param pred_res: PredicateResolver used for the conversion
+        :param options: options affecting the output, see
+                        RDFtoHTMLConverter.get_output_options
+        :param input_format: format the file is read as, guessed if None
+        :return: dictionary to compare with the recorded conversion
+        """
+        if not isinstance(languages, list):
+            languages = [languages]
+        return {'hash': get_file_hash(input_file),
+                'languages': sorted(languages),
+                'options': options or {},
+                'input_format': input_format,
+                'version': __version__,
+                'vocabularies': pred_res.get_generation()}
+
+    def is_current(self, input_file, record):
+        """
+        Are the outputs of an input file already converted the way the
+        record describes?
+        :param input_file: path of the RDF file
+        :param record: dictionary returned by create_record
+        """
+        # Without a vocabulary cache there is no telling whether the
+        # vocabularies, or the downloads that failed, are the same
+        if record.get('vocabularies') is None:
+            return False
+
+        old_record = self._load().get(os.path.abspath(input_file))
+        if not old_record:
+            return False
+
+        for key, value in record.iteritems():
+            if old_record.get(key) != value:
+                return False
+
+        # The outputs may have been removed by hand
+        outputs = old_record.get('outputs') or []
+        return all(os.path.exists(os.path.join(self.folder, output))
+                   for output in outputs)
+
+    def update(self, input_file, record, outputs):
+        """
+        Record the conversion of an input file
+        :param input_file: path of the RDF file
+        :param record: dictionary returned by create_record
+        :param outputs: paths of the files written
+        """
+        record = dict(record)
+        record['outputs'] = sorted(os.path.basename(path) for path in outputs)
+
+        # Several processes may convert files to the same directory
+        with open(os.path.join(self.folder, LOCK_NAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                inputs = self._load()
+                inputs[os.path.abspath(input_file)] = record
+                self._save(inputs)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        """
+        Read the recorded conversions
+        :return: dictionary of input file -> record
+        """
+        try:
+            with open(self.path) as file_obj:
+                return json.load(file_obj)['inputs']
+        except (IOError, OSError):
+            return {}
+        except (ValueError, KeyError, TypeError) as err:
+            logging.warning('Ignoring corrupt build manifest %s. %s',
+                            self.path, err)
+            return {}
+
+    def _save(self, inputs):
+        """
+        Write the recorded conversions
+        """
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.ht',
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'w') as file_obj:
+                json.dump({'inputs': inputs}, file_obj, indent=1,
+                          sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as err:
+            logging.warning('Unable to write build manifest %s. %s',
+                            self.path, err)
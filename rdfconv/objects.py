@@ -3,6 +3,7 @@ Class containing code related to RDF objects
 """
 
 import hashlib
+from operator import itemgetter
 from rdfconv.utils import get_attribute
 from rdfconv.html import format_literal
 
@@ -20,12 +21,79 @@ TITLE_CANDIDATES = [TITLE, FOAF_NAME, LABEL, VCARD_NAME]
 DESC_CANDIDATES = [DESC]
 
 
+class AttributeMap(object):
+    """
+    Read only dictionary of predicate -> objects, stored as tuples to
+    take up a fraction of the memory of a dictionary. Objects only have a
+    handful of predicates, so finding one by comparing them in turn is
+    as fast as hashing.
+    """
+
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, items):
+        if isinstance(items, (dict, AttributeMap)):
+            items = items.items()
+        items = sorted(items, key=itemgetter(0))
+        self._keys = tuple(key for key, _ in items)
+        self._values = tuple(tuple(value) for _, value in items)
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        """
+        Get the objects of a predicate or default if it's missing
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._keys, self._values)
+
+    def iterkeys(self):
+        return iter(self._keys)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return iter(self.items())
+
+
 class RdfObject(object):
     """
     Class representing an rdf object.
     Contains methods for easily accessing common attributes
     """
 
+    # Catalogs can have hundreds of thousands of objects
+    __slots__ = ('type', 'id', 'title', 'description', 'attributes',
+                 '_ns_mgr', '_titles')
+
     def __init__(self, id, attributes, ns_mgr=None):
 
         # Rdf type
@@ -34,14 +102,13 @@ class RdfObject(object):
         # Rdf id
         self.id = id
 
-        # Fragment id
-        self.fragment = hashlib.md5(id).hexdigest()
-
         # List of potential titles and descriptions
         self.title = None
         self.description = None
 
         # Other attributes
+        if not isinstance(attributes, AttributeMap):
+            attributes = AttributeMap(attributes)
         self.attributes = attributes
 
         # Try to find a type
@@ -56,9 +123,21 @@ class RdfObject(object):
         # Reference to a ns manager
         self._ns_mgr = ns_mgr
 
+        # Language -> title. The title is used for sorting, in the summary
+        # and by every object linking to this one, in every language.
+        self._titles = None
+
     def __repr__(self):
         return self.id
 
+    @property
+    def fragment(self):
+        """
+        Fragment id, derived when needed instead of keeping a 32
+        character string on every object
+        """
+        return hashlib.md5(self.id).hexdigest()
+
     def __eq__(self, other):
         return self.id == other.id
 
@@ -66,11 +145,18 @@ class RdfObject(object):
         """
         Gets the title of the RDF object
         """
+        if self._titles is None:
+            self._titles = {}
+        elif language in self._titles:
+            return self._titles[language]
+
         candidates = format_literal(self.title, language)
         if candidates:
-            return candidates[0]
+            title = candidates[0]
         else:
-            return self.id
+            title = self.id
+        self._titles[language] = title
+        return title
 
     def get_description(self, language):
         """
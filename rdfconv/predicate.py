@@ -2,11 +2,20 @@
 Module containing functionallity for resolving predicate names from
 third party sources.
 """
+import os
+import json
+import time
+import hashlib
 import logging
+import threading
+import urlparse
+from multiprocessing.pool import ThreadPool
 import requests
 import rdflib
 import StringIO
 
+from rdfconv.cache import CacheEntry, DEFAULT_NEGATIVE_TTL
+
 LABEL_CANDIDATES = ['http://www.w3.org/2000/01/rdf-schema#label']
 
 # All providers don't use the correct way of supplying the rdf
@@ -20,15 +29,203 @@ FORMATS = {
     'http://schema.theodi.org/odrs': 'n3',
 }
 
+# Seconds to wait for a connection to a vocabulary host and for the
+# vocabulary to be sent
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 15
+
+# Seconds before a host that failed is contacted again
+DEFAULT_BREAKER_RESET = 5 * 60
+
+# Returned by PredicateResolver._download instead of labels when the host
+# of a vocabulary isn't contacted, since it recently failed
+SKIPPED = object()
+
+# Number of vocabularies downloaded in parallel when prefetching
+DEFAULT_WORKERS = 8
+
+# Pre-parsed labels of the most common vocabularies, used in offline mode
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'vocabularies')
+
+
+def get_vocabulary_url(url):
+    """
+    Get the url of the vocabulary defining a predicate or type
+    :param url: url of the predicate
+    :return:
+    """
+    # Most providers use # or / for delimiting the identifier from the
+    # actual download url
+    if '#' in url:
+        url = url.rsplit('#', 1)[0]
+    elif '/' in url:
+        url = url.rsplit('/', 1)[0]
+    return url
+
+
+def load_snapshots(directories):
+    """
+    Load vocabulary snapshots from one or more directories. Each snapshot
+    is a JSON file with the url of the vocabulary and its labels. Snapshots
+    in later directories override those in earlier ones.
+    :param directories: list of directories
+    :return: dictionary of vocabulary url -> subject -> language -> label
+    """
+    snapshots = {}
+    for directory in directories:
+        if not directory or not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path) as file_obj:
+                    data = json.load(file_obj)
+                snapshots[data['url']] = data['labels']
+            except (IOError, ValueError, KeyError) as err:
+                logging.warning('Unable to load vocabulary snapshot %s. %s',
+                                path, err)
+    return snapshots
+
+
+class CircuitBreaker(object):
+    """
+    Per host circuit breaker. Once a host has failed, no more requests are
+    sent to it until the reset timeout has passed.
+    """
+
+    def __init__(self, threshold=1, reset_timeout=DEFAULT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        # Host -> number of consecutive failures
+        self._failures = {}
+
+        # Host -> time when requests may be sent again
+        self._open_until = {}
+
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """
+        May a request be sent to the host?
+        """
+        with self._lock:
+            return self._open_until.get(host, 0) <= time.time()
+
+    def record_failure(self, host):
+        """
+        Register a failed request to a host
+        """
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.threshold:
+                logging.warning('Not contacting %s for %d seconds',
+                                host, self.reset_timeout)
+                self._open_until[host] = time.time() + self.reset_timeout
+
+    def record_success(self, host):
+        """
+        Register a successful request to a host
+        """
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open_until.pop(host, None)
+
+
+# Resolvers shared by all converters in the process
+_SHARED_RESOLVERS = {}
+_SHARED_RESOLVERS_LOCK = threading.Lock()
+
+
+def get_shared_resolver(cache=None, **kwargs):
+    """
+    Get a resolver shared by all converters in the process using the same
+    configuration. This avoids downloading the same vocabularies again for
+    every file and language.
+    :param cache: persistent VocabularyCache or None
+    :param kwargs: other arguments passed to PredicateResolver
+    :return: a PredicateResolver
+    """
+    if cache:
+        cache_key = (cache.cache_dir, cache.ttl, cache.max_size,
+                     cache.negative_ttl)
+    else:
+        cache_key = None
+    key = (cache_key, tuple(sorted(kwargs.items())))
+
+    with _SHARED_RESOLVERS_LOCK:
+        if key not in _SHARED_RESOLVERS:
+            _SHARED_RESOLVERS[key] = PredicateResolver(cache, **kwargs)
+        return _SHARED_RESOLVERS[key]
+
+
+def clear_shared_resolvers():
+    """
+    Forget all shared resolvers, forcing vocabularies to be loaded again
+    """
+    with _SHARED_RESOLVERS_LOCK:
+        _SHARED_RESOLVERS.clear()
+
 
 class PredicateResolver(object):
     """
     Class for resolving a human readable version of an RDF predicate
     """
 
-    def __init__(self):
+    def __init__(self, cache=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, offline=False,
+                 vocabulary_dir=None, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 breaker_reset=DEFAULT_BREAKER_RESET):
         self._resolved = {}
-        self._parsed = []
+        self._parsed = set()
+
+        # Persistent cache shared between runs, see rdfconv.cache
+        self._cache = cache
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # Vocabularies that couldn't be downloaded or parsed are not
+        # retried until their entry here has expired
+        self.negative_ttl = negative_ttl
+        self._failed = {}
+
+        self._breaker = CircuitBreaker(reset_timeout=breaker_reset)
+
+        # In offline mode vocabularies are only read from the bundled
+        # snapshots and the local override directory
+        self.offline = offline
+        self._snapshots = None
+        self._snapshot_generation = None
+        if offline:
+            self._snapshots = load_snapshots([SNAPSHOT_DIR, vocabulary_dir])
+
+            # Editing the snapshots, or using other ones, changes the
+            # generation
+            digest = hashlib.sha1(json.dumps(self._snapshots, sort_keys=True))
+            if vocabulary_dir:
+                digest.update(os.path.abspath(vocabulary_dir))
+            self._snapshot_generation = 'offline-' + digest.hexdigest()
+
+        # Vocabularies may be downloaded from several threads
+        self._lock = threading.Lock()
+        self._vocabulary_locks = {}
+
+    def get_generation(self):
+        """
+        Get an identifier of the vocabularies used to resolve predicates,
+        which changes when they are updated
+        :return: a string or None if the vocabularies aren't cached
+        """
+        if self.offline:
+            return self._snapshot_generation
+        if self._cache:
+            return self._cache.get_generation()
+        return None
 
     def _get_from_cache(self, url, language):
         """
@@ -63,23 +260,135 @@ class PredicateResolver(object):
         # It should now be present in the cache
         return self._get_from_cache(url, language)
 
+    def prefetch(self, urls, workers=DEFAULT_WORKERS):
+        """
+        Download the vocabularies of several predicates in parallel.
+        :param urls: urls of the predicates
+        :param workers: maximum number of simultaneous downloads
+        :return:
+        """
+        vocabularies = set(get_vocabulary_url(url) for url in urls)
+        vocabularies -= self._parsed
+        if not vocabularies:
+            return
+
+        if self.offline:
+            # Nothing to wait for
+            for url in vocabularies:
+                self._load_vocabulary(url)
+            return
+
+        pool = ThreadPool(min(workers, len(vocabularies)))
+        try:
+            pool.map(self._load_vocabulary, sorted(vocabularies))
+        finally:
+            pool.close()
+            pool.join()
+
     def get_rdf(self, url):
         """
         :param url:
         :return:
         """
-        # Most providers use # or / for delimiting the identifier from the
-        # actual download url
-        if '#' in url:
-            url = url.rsplit('#', 1)[0]
-        elif '/' in url:
-            url = url.rsplit('/', 1)[0]
+        self._load_vocabulary(get_vocabulary_url(url))
 
+    def _load_vocabulary(self, url):
+        """
+        Load the labels of a vocabulary
+        :param url: url of the vocabulary, see get_vocabulary_url
+        """
         # Have we already downloaded and this url?
-        if url in self._parsed:
+        if url in self._parsed or self._has_failed(url):
+            return
+
+        if self.offline:
+            self._add_labels(url, self._snapshots.get(url, {}))
             return
 
+        # Make sure only one thread downloads each vocabulary
+        with self._lock:
+            vocabulary_lock = self._vocabulary_locks.setdefault(
+                url, threading.Lock())
+
+        with vocabulary_lock:
+            if url in self._parsed or self._has_failed(url):
+                return
+
+            # Has another run already downloaded it?
+            entry = None
+            if self._cache:
+                entry = self._cache.get(url)
+                if entry and self._cache.is_fresh(entry):
+                    if entry.failed:
+                        self._set_failed(url, entry.fetched)
+                    else:
+                        self._add_labels(url, entry.labels)
+                    return
+                if entry and entry.failed:
+                    # Nothing to revalidate
+                    entry = None
+
+            labels = self._download(url, entry)
+            if labels is not None and labels is not SKIPPED:
+                self._add_labels(url, labels)
+            elif entry:
+                # A stale vocabulary is better than none at all
+                self._add_labels(url, entry.labels)
+            elif labels is SKIPPED:
+                # Only vocabularies that actually failed are remembered,
+                # this one is tried again once its host is contacted
+                return
+            else:
+                self._set_failed(url)
+                if self._cache:
+                    self._cache.put(CacheEntry(url, {}, failed=True))
+
+    def fetch(self, url):
+        """
+        Download and parse a vocabulary, bypassing the labels already
+        loaded. Used to create vocabulary snapshots, see
+        devel/snapshot_vocabularies.py.
+        :param url: url of the vocabulary, see get_vocabulary_url
+        :return: dictionary of subject -> language -> label or None if the
+                 vocabulary couldn't be downloaded or parsed, or its host
+                 recently failed
+        """
+        labels = self._download(url)
+        if labels is SKIPPED:
+            return None
+        return labels
+
+    def _has_failed(self, url):
+        """
+        Has the vocabulary recently failed to download or parse?
+        """
+        return self._failed.get(url, 0) > time.time()
+
+    def _set_failed(self, url, failed_at=None):
+        """
+        Remember that a vocabulary failed to download or parse
+        """
+        if failed_at is None:
+            failed_at = time.time()
+        with self._lock:
+            self._failed[url] = failed_at + self.negative_ttl
+
+    def _download(self, url, entry=None):
+        """
+        Download and parse a vocabulary. If a stale cache entry is given
+        it is revalidated using a conditional request.
+        :param url: url of the vocabulary
+        :param entry: stale cache entry for the url or None
+        :return: dictionary of subject -> language -> label, None if the
+                 vocabulary couldn't be downloaded or parsed or SKIPPED if
+                 its host recently failed
+        """
         headers = {'Accept': 'application/rdf+xml'}
+        if entry:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
 
         # Some URLs we've encountered do not provide xml versions of the rdf
         if url in FORMATS:
@@ -90,19 +399,62 @@ class PredicateResolver(object):
         # Some URLs also do not follow the standard way of requesting a
         # the resource on a different format. They do however provide
         # the resource but at a differnt URL.
-        if url in URL_REMAP:
-            url = URL_REMAP[url]
+        download_url = URL_REMAP.get(url, url)
+
+        # Don't wait for hosts that recently failed
+        host = urlparse.urlparse(download_url).netloc
+        if not self._breaker.allow(host):
+            logging.info('Skipping %s, %s is unavailable', download_url, host)
+            return SKIPPED
 
-        logging.info('Downloading %s', url)
+        logging.info('Downloading %s', download_url)
         try:
-            resp = requests.get(url, headers=headers)
+            resp = requests.get(download_url, headers=headers,
+                                timeout=(self.connect_timeout,
+                                         self.read_timeout))
         except Exception as err:  # pylint: disable=W0703
             # We want to catch all exceptions here
-            logging.warning('Unable to download %s. %s', url, err.message)
+            logging.warning('Unable to download %s. %s', download_url, err)
+            self._breaker.record_failure(host)
+            return
+
+        if resp.status_code >= 500:
+            logging.warning('Unable to download %s. Status %d',
+                            download_url, resp.status_code)
+            self._breaker.record_failure(host)
+            return
+        self._breaker.record_success(host)
+
+        if resp.status_code == 304 and entry:
+            logging.info('%s not modified', download_url)
+            self._cache.touch(entry)
+            return entry.labels
+
+        if resp.status_code >= 400:
+            logging.warning('Unable to download %s. Status %d',
+                            download_url, resp.status_code)
             return
 
+        labels = self._parse(resp.text, download_url, rdf_format)
+        if labels is not None and self._cache:
+            self._cache.put(CacheEntry(
+                url, labels,
+                etag=resp.headers.get('ETag'),
+                last_modified=resp.headers.get('Last-Modified')))
+        return labels
+
+    @staticmethod
+    def _parse(text, url, rdf_format):
+        """
+        Parse the labels from a vocabulary
+        :param text: the vocabulary
+        :param url: url the vocabulary was downloaded from
+        :param rdf_format: format of the vocabulary
+        :return: dictionary of subject -> language -> label or None if the
+                 vocabulary couldn't be parsed
+        """
         file_obj = StringIO.StringIO()
-        file_obj.write(resp.text.encode('utf-8'))
+        file_obj.write(text.encode('utf-8'))
         file_obj.seek(0)
 
         graph = rdflib.Graph()
@@ -111,16 +463,32 @@ class PredicateResolver(object):
         except Exception as err:  # pylint: disable=W0703
             # We want to catch all exceptions here
             logging.warning('Unable to parse file: %s. %s', url, err.message)
+            return
+
+        labels = {}
         for subj, pred, obj in graph:
 
             if isinstance(obj, rdflib.Literal) and unicode(pred) in LABEL_CANDIDATES:
                 subj = unicode(subj)
-                if subj not in self._resolved:
-                    self._resolved[subj] = {}
+                if subj not in labels:
+                    labels[subj] = {}
                 if obj.language:
                     language = obj.language
                 else:
                     language = 'en'
-                self._resolved[subj][language] = unicode(obj.value).title()
+                labels[subj][language] = unicode(obj.value).title()
+        return labels
 
-        self._parsed.append(url)
+    def _add_labels(self, url, labels):
+        """
+        Add parsed labels to the resolved names and mark the vocabulary
+        as parsed
+        :param url: url of the vocabulary
+        :param labels: dictionary of subject -> language -> label
+        """
+        with self._lock:
+            for subj, languages in labels.iteritems():
+                if subj not in self._resolved:
+                    self._resolved[subj] = {}
+                self._resolved[subj].update(languages)
+            self._parsed.add(url)
@@ -0,0 +1,347 @@
+"""
+Contains the renderers used to turn the nodes built by HtmlConverter into
+HTML. The fast renderer produces the same markup as the Django templates
+in rdfconv/templates without depending on Django.
+"""
+import os
+import hashlib
+
+
+class Error(Exception):
+    """
+    Base class for exceptions in this module
+    """
+    pass
+
+
+class RendererError(Error):
+    """
+    Raised when an unknown renderer is requested or a renderer can't be
+    used
+    """
+    pass
+
+
+class Renderer(object):
+    """
+    Base class for renderers. A page consists of a header, every node and
+    a footer, which allows pages to be written one node at a time.
+    """
+
+    # Changed whenever the markup of a node changes, so rendered nodes
+    # cached by an earlier version aren't reused
+    version = 1
+
+    def render_header(self, date):
+        """
+        Render the start of a page
+        :param date: date the page was updated
+        """
+        raise NotImplementedError
+
+    def render_node(self, node):
+        """
+        Render a single node as built by HtmlConverter.build_node_dict.
+        Nodes with details instead of attributes are rendered as a
+        summary, whose table is built by rdfconv.js from the file named
+        by details.
+        """
+        raise NotImplementedError
+
+    def render_footer(self):
+        """
+        Render the end of a page
+        """
+        raise NotImplementedError
+
+    def render_start(self, date):
+        """
+        Render everything before the first node of a page, with the same
+        whitespace as main.html
+        :param date: date the page was updated
+        """
+        return self.render_header(date) + u'\n'
+
+    def iter_node_parts(self, nodes):
+        """
+        Render nodes piece by piece, with the same whitespace as main.html
+        :param nodes: iterable of nodes
+        """
+        return self.iter_fragment_parts(self.render_node(node)
+                                        for node in nodes)
+
+    def iter_fragment_parts(self, fragments):
+        """
+        Join nodes that have already been rendered, with the same
+        whitespace as main.html
+        :param fragments: iterable of nodes returned by render_node
+        """
+        for fragment in fragments:
+            yield u'\n    '
+            yield fragment
+            yield u'\n'
+
+    def render_end(self):
+        """
+        Render everything after the last node of a page, with the same
+        whitespace as main.html
+        """
+        return u'\n' + self.render_footer()
+
+    def iter_page(self, nodes, date):
+        """
+        Render a page piece by piece
+        :param nodes: iterable of nodes
+        :param date: date the page was updated
+        """
+        yield self.render_start(date)
+        for part in self.iter_node_parts(nodes):
+            yield part
+        yield self.render_end()
+
+    def render_page(self, nodes, date):
+        """
+        Render a full page
+        :param nodes: list of nodes
+        :param date: date the page was updated
+        """
+        return u''.join(self.iter_page(nodes, date))
+
+    def render_index(self, title, pages, date):
+        """
+        Render the index of a file whose nodes are split between pages
+        :param title: title of the index
+        :param pages: list of dictionaries with the link, the titles of
+                      the first and last node and the number of nodes of
+                      every page
+        :param date: date the pages were updated
+        """
+        raise NotImplementedError
+
+
+class DjangoRenderer(Renderer):
+    """
+    Renders the Django templates in rdfconv/templates
+    """
+
+    def __init__(self):
+        try:
+            from django.conf import settings
+            from django.template import Context
+            from django.template.loader import get_template
+        except ImportError:
+            raise RendererError('The django renderer requires Django to be '
+                                'installed')
+
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        if not settings.configured:
+            settings.configure(
+                TEMPLATE_DIRS=(os.path.join(base_dir, 'templates'),),
+                TEMPLATE_LOADERS=("django.template.loaders.filesystem.Loader",),
+                TEMPLATE_DEBUG=True)
+
+        self._context = Context
+        self._main_template = get_template('main.html')
+        self._header_template = get_template('header.html')
+        self._node_template = get_template('node.html')
+        self._summary_template = get_template('summary.html')
+        self._footer_template = get_template('footer.html')
+        self._index_template = get_template('index.html')
+
+        # The templates can be edited after installation
+        digest = hashlib.md5()
+        for name in ('node.html', 'summary.html'):
+            with open(os.path.join(base_dir, 'templates', name)) as node:
+                digest.update(node.read())
+        self.version = digest.hexdigest()
+
+    def render_header(self, date):
+        return self._header_template.render(self._context({'date': date}))
+
+    def render_node(self, node):
+        template = self._node_template
+        if 'details' in node:
+            template = self._summary_template
+        return template.render(self._context({'node': node}))
+
+    def render_footer(self):
+        return self._footer_template.render(self._context())
+
+    def render_page(self, nodes, date):
+        return self._main_template.render(self._context({'nodes': nodes,
+                                                         'date': date}))
+
+    def render_index(self, title, pages, date):
+        return self._index_template.render(self._context({'title': title,
+                                                          'pages': pages,
+                                                          'date': date}))
+
+
+class FastRenderer(Renderer):
+    """
+    Renders the same markup as the Django templates using plain string
+    formatting, which is considerably faster
+    """
+
+    HEADER = (u'<html>\n'
+              u'<head>\n'
+              u'    <link rel="stylesheet" type="text/css" href="style.css">\n'
+              u'    <meta charset="UTF-8">\n'
+              u'    <script src="http://ajax.googleapis.com/ajax/libs/jquery/1.11.3/jquery.min.js"></script>\n'
+              u'    <script src="rdfconv.js"></script>\n'
+              u'</head>\n'
+              u'<div style="float: right;">\n'
+              u'    Updated %s\n'
+              u'</div>')
+
+    SUMMARY = (u'<div class="rdf_obj" id="%s">\n'
+               u'    <div class="title">\n'
+               u'        <h1>%s</h1>\n'
+               u'    </div>\n'
+               u'    <div class="type">\n'
+               u'        <h2>%s</h2>\n'
+               u'    </div>\n'
+               u'    <div class="desc">%s </div>')
+
+    NODE_START = (u'\n'
+                  u'    <div class="full_info">\n'
+                  u'        <table>\n'
+                  u'            <tbody>\n'
+                  u'            ')
+
+    SUMMARY_END = (u'\n'
+                   u'    <div class="full_info" data-details="%s"></div>\n'
+                   u'    <a class="show_more">Show more</a>\n'
+                   u'</div>')
+
+    ATTR_START = (u'\n'
+                  u'                <tr>\n'
+                  u'                    <td><a href="%s">%s</a></td>\n'
+                  u'                    <td>\n'
+                  u'                    ')
+
+    OBJ_LINK = (u'\n'
+                u'                        \n'
+                u'                            <a href="%s">%s</a><br />\n'
+                u'                        \n'
+                u'                    ')
+
+    OBJ_TEXT = (u'\n'
+                u'                        \n'
+                u'                            %s\n'
+                u'                        \n'
+                u'                    ')
+
+    ATTR_END = (u'\n'
+                u'                    </td>\n'
+                u'                </tr>\n'
+                u'            ')
+
+    NODE_END = (u'\n'
+                u'            </tbody>\n'
+                u'        </table>\n'
+                u'    </div>\n'
+                u'    <a class="show_more">Show more</a>\n'
+                u'</div>')
+
+    FOOTER = u'</html>'
+
+    INDEX_START = (u'\n'
+                   u'<div class="index">\n'
+                   u'    <h1>%s</h1>\n'
+                   u'    <ul>\n'
+                   u'    ')
+
+    INDEX_PAGE = (u'\n'
+                  u'        <li><a href="%s">%s &ndash; %s</a> (%s)</li>\n'
+                  u'    ')
+
+    INDEX_END = (u'\n'
+                 u'    </ul>\n'
+                 u'</div>\n')
+
+    def render_header(self, date):
+        return self.HEADER % _escape(date)
+
+    def render_node(self, node):
+        parts = [self.SUMMARY % (_escape(node.get('node_id', u'')),
+                                 _escape(node.get('title', u'')),
+                                 _escape(node.get('rdf_type', u'')),
+                                 _to_text(node.get('desc', u'')))]
+        if 'details' in node:
+            parts.append(self.SUMMARY_END % _escape(node['details']))
+            return u''.join(parts)
+
+        parts.append(self.NODE_START)
+
+        for attr in node.get('attributes', []):
+            parts.append(self.ATTR_START % (_escape(attr.get('pred_link', u'')),
+                                            _escape(attr.get('pred_title', u''))))
+            for obj in attr.get('objs', []):
+                if obj.get('link'):
+                    parts.append(self.OBJ_LINK % (_escape(obj['link']),
+                                                  _escape(obj.get('title', u''))))
+                else:
+                    parts.append(self.OBJ_TEXT % _to_text(obj.get('title', u'')))
+            parts.append(self.ATTR_END)
+
+        parts.append(self.NODE_END)
+        return u''.join(parts)
+
+    def render_footer(self):
+        return self.FOOTER
+
+    def render_index(self, title, pages, date):
+        parts = [self.render_header(date), self.INDEX_START % _escape(title)]
+        for page in pages:
+            parts.append(self.INDEX_PAGE % (_escape(page['link']),
+                                            _escape(page['first']),
+                                            _escape(page['last']),
+                                            _escape(page['count'])))
+        parts.append(self.INDEX_END)
+        parts.append(self.FOOTER)
+        return u''.join(parts)
+
+
+RENDERERS = {
+    'fast': FastRenderer,
+    'django': DjangoRenderer,
+}
+
+DEFAULT_RENDERER = 'fast'
+
+
+def get_renderer(name=DEFAULT_RENDERER):
+    """
+    Create a renderer by name
+    :param name: one of RENDERERS
+    :return: a Renderer
+    """
+    try:
+        renderer_class = RENDERERS[name]
+    except KeyError:
+        raise RendererError('Unknown renderer %s. Available renderers: %s'
+                            % (name, ', '.join(sorted(RENDERERS))))
+    return renderer_class()
+
+
+def _to_text(value):
+    """
+    Convert a value to unicode the way Django does when rendering it
+    """
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+
+def _escape(value):
+    """
+    Escape a value for use in HTML, like Django's autoescaping
+    """
+    return (_to_text(value).replace(u'&', u'&amp;')
+            .replace(u'<', u'&lt;')
+            .replace(u'>', u'&gt;')
+            .replace(u'"', u'&quot;')
+            .replace(u"'", u'&#39;'))
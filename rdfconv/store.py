@@ -0,0 +1,385 @@
+"""
+Module containing a disk-backed store of RdfObjects, used to convert
+catalogs that don't fit in memory. The parsed triples are written to an
+SQLite database, grouped by subject there and read back one object at a
+time while the pages are written.
+"""
+import os
+import cPickle
+import sqlite3
+import tempfile
+from itertools import groupby
+from collections import Mapping, OrderedDict
+
+from rdflib.term import URIRef, BNode, Literal
+
+from rdfconv.ingest import BNODE_ROUNDS, TripleSink, get_signature_line, \
+    get_signature_digest, iter_bnode_names
+from rdfconv.objects import RdfObject
+
+# Kinds of terms, as stored in the database
+URI = 0
+BLANK = 1
+LITERAL = 2
+
+# Number of triples written to the database at a time
+BATCH_SIZE = 10000
+
+# Number of objects kept in memory. Objects linked to by many others,
+# such as publishers and licenses, are looked up over and over.
+OBJECT_CACHE_SIZE = 2000
+
+# Memory used by SQLite for its page cache, in KiB
+SQLITE_CACHE_SIZE = 32 * 1024
+
+SCHEMA = '''
+CREATE TABLE triples (
+    subject TEXT,
+    subject_kind INTEGER,
+    predicate TEXT,
+    kind INTEGER,
+    value TEXT,
+    language TEXT,
+    datatype TEXT
+);
+CREATE TABLE bnode_digests (
+    bnode TEXT PRIMARY KEY,
+    digest TEXT
+);
+CREATE TABLE bnode_refined (
+    bnode TEXT,
+    digest TEXT
+);
+CREATE TABLE bnode_names (
+    bnode TEXT PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE objects (
+    id TEXT PRIMARY KEY,
+    type TEXT,
+    sort_type TEXT,
+    sort_title TEXT,
+    attributes BLOB
+);
+'''
+
+INDEXES = '''
+CREATE INDEX objects_order ON objects (sort_type, sort_title, id);
+CREATE INDEX objects_type ON objects (type, sort_type, sort_title, id);
+'''
+
+# The triples of every blank node, with those it is the object of
+# marked by direction 1, and the digests of the blank nodes they link
+# to from the previous round
+BNODE_TRIPLES = '''
+SELECT b.*, d.digest FROM (
+    SELECT subject AS bnode, 0, predicate, kind, value, language, datatype
+    FROM triples WHERE subject_kind = 1
+    UNION
+    SELECT value, 1, predicate, subject_kind, subject, NULL, NULL
+    FROM triples WHERE kind = 1
+) AS b
+LEFT JOIN bnode_digests AS d ON b.kind = 1 AND d.bnode = b.value
+ORDER BY 1
+'''
+
+# The triples grouped by subject, with the blank nodes renamed and the
+# duplicates removed
+OBJECT_TRIPLES = '''
+SELECT DISTINCT COALESCE(s.name, t.subject), t.predicate, t.kind,
+                COALESCE(o.name, t.value), t.language, t.datatype
+FROM triples AS t
+LEFT JOIN bnode_names AS s ON t.subject_kind = 1 AND s.bnode = t.subject
+LEFT JOIN bnode_names AS o ON t.kind = 1 AND o.bnode = t.value
+ORDER BY 1
+'''
+
+ORDER = ' ORDER BY sort_type, sort_title, id'
+
+
+class StoreSink(TripleSink):
+    """
+    TripleSink writing the triples to an ObjectStore instead of keeping
+    them in memory. Only the languages and prefixes are kept.
+    """
+
+    def __init__(self, store):
+        super(StoreSink, self).__init__()
+        self._store = store
+        self._rows = []
+
+    def add(self, triple):
+        """
+        Add a triple, called by the parser
+        """
+        subj, pred, obj = triple
+        if isinstance(obj, Literal) and obj.language:
+            self.languages.add(obj.language)
+
+        subj_kind = BLANK if isinstance(subj, BNode) else URI
+        self._rows.append((unicode(subj), subj_kind, unicode(pred)) +
+                          _encode_term(obj))
+        if len(self._rows) >= BATCH_SIZE:
+            self._store.add_triples(self._rows)
+            self._rows = []
+
+    def finish(self):
+        """
+        Write the remaining triples. Duplicates are removed when the
+        store is built.
+        """
+        self._store.add_triples(self._rows)
+        self._rows = []
+
+
+class ObjectStore(Mapping):
+    """
+    Read only dictionary of id -> RdfObject backed by an SQLite database.
+    Iterating it yields the objects sorted by type and title, like the
+    dictionary built by RDFtoHTMLConverter, while only a bounded number
+    of them are kept in memory.
+    """
+
+    def __init__(self, path=None):
+        # Unless a path is given the database is temporary and removed
+        # when the store is closed
+        self._temporary = not path
+        if not path:
+            handle, path = tempfile.mkstemp(prefix='rdf-to-html-',
+                                            suffix='.sqlite')
+            os.close(handle)
+        self.path = path
+
+        self._ns_mgr = None
+        self._connection = None
+        self._pid = None
+        self._size = None
+
+        # Most recently used objects, id -> RdfObject or None if missing
+        self._cache = OrderedDict()
+
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        """
+        Get the connection to the database. Processes forked by the
+        converter can't share the connection of their parent, so they
+        open their own.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path)
+            self._pid = os.getpid()
+
+            # The database is thrown away if the conversion fails
+            self._connection.execute('PRAGMA journal_mode = OFF')
+            self._connection.execute('PRAGMA synchronous = OFF')
+            self._connection.execute('PRAGMA cache_size = -%d'
+                                     % SQLITE_CACHE_SIZE)
+        return self._connection
+
+    def add_triples(self, rows):
+        """
+        Write triples encoded by StoreSink
+        """
+        self._connect().executemany('INSERT INTO triples VALUES '
+                                    '(?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def build(self, ns_mgr):
+        """
+        Group the triples into objects, once all triples have been added
+        :param ns_mgr: namespace manager of the parsed file
+        """
+        self._ns_mgr = ns_mgr
+        connection = self._connect()
+        self._name_bnodes()
+
+        rows = connection.execute(OBJECT_TRIPLES)
+        connection.executemany('INSERT INTO objects VALUES (?, ?, ?, ?, ?)',
+                               self._iter_object_rows(rows))
+
+        connection.executescript(INDEXES)
+        connection.execute('DELETE FROM triples')
+        connection.execute('DELETE FROM bnode_digests')
+        connection.commit()
+
+    def _name_bnodes(self):
+        """
+        Name the blank nodes after their triples, the same way as
+        TripleSink.rename_bnodes
+        """
+        connection = self._connect()
+        count_digests = 'SELECT COUNT(DISTINCT digest) FROM %s'
+        for i in xrange(BNODE_ROUNDS):
+            connection.executemany('INSERT INTO bnode_refined VALUES (?, ?)',
+                                   _iter_bnode_digests(
+                                       connection.execute(BNODE_TRIPLES)))
+            refined, = connection.execute(count_digests
+                                          % 'bnode_refined').fetchone()
+            digests, = connection.execute(count_digests
+                                          % 'bnode_digests').fetchone()
+            if i and refined <= digests:
+                break
+            connection.execute('DELETE FROM bnode_digests')
+            connection.execute('INSERT INTO bnode_digests '
+                               'SELECT * FROM bnode_refined')
+            connection.execute('DELETE FROM bnode_refined')
+        connection.execute('DELETE FROM bnode_refined')
+
+        digests = connection.execute('SELECT digest, bnode '
+                                     'FROM bnode_digests '
+                                     'ORDER BY digest, bnode')
+        connection.executemany('INSERT INTO bnode_names VALUES (?, ?)',
+                               iter_bnode_names(digests))
+
+    def _iter_object_rows(self, rows):
+        """
+        Turn the triples of each subject into a row of the objects table
+        """
+        for subj, triples in groupby(rows, lambda row: row[0]):
+            attributes = {}
+            for _, pred, kind, value, language, datatype in triples:
+                term = _decode_term(kind, value, language, datatype)
+                attributes.setdefault(pred, []).append(term)
+
+            # Sorted the same way as the lists of a catalog in memory
+            for obj_list in attributes.itervalues():
+                obj_list.sort(key=lambda term: term.n3())
+
+            obj = RdfObject(subj, attributes, self._ns_mgr)
+            sort_type, sort_title = obj.get_sort_tuple('en')
+            rdf_type = obj.type.n3() if obj.type is not None else None
+            data = cPickle.dumps(attributes.items(), cPickle.HIGHEST_PROTOCOL)
+            yield subj, rdf_type, sort_type, sort_title, buffer(data)
+
+    def disconnect(self):
+        """
+        Close the connection to the database, it is opened again when
+        needed. Called before forking, since an SQLite connection mustn't
+        be carried over into a child process.
+        """
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    def close(self):
+        """
+        Close the database, removing it if it is temporary
+        """
+        self.disconnect()
+        if self._temporary and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _load(self, rdf_id):
+        """
+        Get an object by id
+        :return: the RdfObject or None if there is none with the id
+        """
+        try:
+            obj = self._cache.pop(rdf_id)
+        except KeyError:
+            row = self._connect().execute('SELECT attributes FROM objects '
+                                          'WHERE id = ?', (rdf_id,)).fetchone()
+            obj = self._create_object(rdf_id, row[0]) if row else None
+            if len(self._cache) >= OBJECT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        self._cache[rdf_id] = obj
+        return obj
+
+    def _create_object(self, rdf_id, data):
+        """
+        Create an RdfObject from a row of the objects table
+        """
+        return RdfObject(rdf_id, cPickle.loads(str(data)), self._ns_mgr)
+
+    def _iter_objects(self, query, params=()):
+        """
+        Generate the objects selected by a query for id and attributes
+        """
+        for rdf_id, data in self._connect().execute(query, params):
+            obj = self._cache.get(rdf_id)
+            if obj is None:
+                obj = self._create_object(rdf_id, data)
+            yield obj
+
+    def __getitem__(self, rdf_id):
+        obj = self._load(rdf_id)
+        if obj is None:
+            raise KeyError(rdf_id)
+        return obj
+
+    def __contains__(self, rdf_id):
+        if rdf_id in self._cache:
+            return self._cache[rdf_id] is not None
+        row = self._connect().execute('SELECT 1 FROM objects WHERE id = ?',
+                                      (rdf_id,)).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for row in self._connect().execute('SELECT id FROM objects' + ORDER):
+            yield row[0]
+
+    def __len__(self):
+        if self._size is None:
+            row = self._connect().execute('SELECT COUNT(*) FROM objects')
+            self._size = row.fetchone()[0]
+        return self._size
+
+    def itervalues(self):
+        return self._iter_objects('SELECT id, attributes FROM objects' + ORDER)
+
+    def select(self, rdf_types, exclude=False):
+        """
+        Generate the objects of some types, in order, using the index
+        on type
+        :param rdf_types: list of URIRefs
+        :param exclude: generate the objects of any other type instead
+        """
+        types = [rdf_type.n3() for rdf_type in rdf_types]
+        marks = ', '.join('?' * len(types))
+        if exclude:
+            where = 'type IS NULL OR type NOT IN (%s)' % marks
+        else:
+            where = 'type IN (%s)' % marks
+        return self._iter_objects('SELECT id, attributes FROM objects '
+                                  'WHERE ' + where + ORDER, types)
+
+
+def _encode_term(term):
+    """
+    Get the kind, value, language and datatype of a term
+    """
+    if isinstance(term, Literal):
+        datatype = unicode(term.datatype) if term.datatype else None
+        return LITERAL, unicode(term), term.language, datatype
+    if isinstance(term, BNode):
+        return BLANK, unicode(term), None, None
+    return URI, unicode(term), None, None
+
+
+def _decode_term(kind, value, language, datatype):
+    """
+    Create a term from the values returned by _encode_term
+    """
+    if kind == LITERAL:
+        if datatype:
+            return Literal(value, datatype=URIRef(datatype))
+        return Literal(value, lang=language)
+    if kind == BLANK:
+        return BNode(value)
+    return URIRef(value)
+
+
+def _iter_bnode_digests(rows):
+    """
+    Get the digests of the signatures of the blank nodes from their
+    triples, see ingest.TripleSink.rename_bnodes
+    :param rows: rows of BNODE_TRIPLES
+    :return: iterator of tuples of blank node and digest
+    """
+    for bnode, triples in groupby(rows, lambda row: row[0]):
+        lines = []
+        for (_, incoming, pred, kind, value, language, datatype,
+             digest) in triples:
+            term = _decode_term(kind, value, language, datatype)
+            lines.append(get_signature_line(incoming, pred, term, digest))
+        yield bnode, get_signature_digest(lines)
@@ -1,6 +1,20 @@
 """
 Contains various utils used by the converter
 """
+import os
+import codecs
+import shutil
+import logging
+import filecmp
+import tempfile
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+# Permissions of new files. Read once, since changing the umask to read
+# it isn't thread safe.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
 def get_attribute(node, candidates):
@@ -20,3 +34,159 @@ def get_file(name, language):
     Format a filename based on a name and a language
     """
     return '%s.html.%s' % (name, language)
+
+
+def get_details_file(name, language):
+    """
+    Format the filename of the attribute tables of the nodes of a page,
+    see HtmlConverter.lazy_details
+    """
+    return '%s.json.%s' % (name, language)
+
+
+def get_link_file(name):
+    """
+    Format the filename used to link to the files of every language of a
+    name, letting mod_negotiation pick the language
+    """
+    return '%s.html' % name
+
+
+def get_page_name(name, page):
+    """
+    Format the name of a page when the nodes are split between pages
+    """
+    return '%s-%d' % (name, page)
+
+
+@contextmanager
+def output_file(path, only_if_changed=False, encoding='utf-8', changed=None):
+    """
+    Open an output file for writing.
+
+    The content is written to a temporary file that atomically replaces
+    the output once it is complete, so readers never see a half written
+    file and a failed conversion leaves the previous output in place. If
+    only_if_changed is set, the output is only replaced if the content
+    differs, so unchanged files keep their modification time.
+    :param path: path of the output file
+    :param only_if_changed: replace the file only if the content differs
+    :param encoding: encoding of the text written or None to write bytes
+    :param changed: list the path is appended to if the file is written,
+                    that is unless only_if_changed is set and the content
+                    is the same
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file_obj:
+            if encoding:
+                yield codecs.getwriter(encoding)(file_obj)
+            else:
+                yield file_obj
+
+        if not (only_if_changed and os.path.exists(path) and
+                filecmp.cmp(tmp_path, path, shallow=False)):
+            os.chmod(tmp_path, 0666 & ~_UMASK)
+            os.rename(tmp_path, path)
+            if changed is not None:
+                changed.append(path)
+    finally:
+        # Unless it replaced the output
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def copy_file(src, dst, only_if_changed=False, changed=None):
+    """
+    Copy a file, see output_file
+    :param src: path of the file to copy
+    :param dst: path of the copy
+    :param only_if_changed: replace the copy only if the content differs
+    :param changed: list the path of the copy is appended to if it is
+                    written
+    """
+    with open(src, 'rb') as src_file:
+        with output_file(dst, only_if_changed, None, changed) as dst_file:
+            shutil.copyfileobj(src_file, dst_file)
+
+
+# State inherited by the processes started by fork_map
+_fork_state = None
+
+# Held while fork_map starts its processes, since conversions in several
+# threads may call it at once
+_fork_lock = threading.Lock()
+
+
+def _fork_call(args):
+    """
+    Call a function with the inherited state in a forked process
+    """
+    func, item = args
+    return func(_fork_state, item)
+
+
+def fork_map(func, state, items, processes):
+    """
+    Call func(state, item) for each item in forked processes. The state is
+    inherited by the processes instead of being pickled for every item.
+    Falls back to calling the function in the current process if it is
+    not allowed to start processes of its own.
+
+    It is safe to call from several threads, but the forked processes
+    only get the thread that called it. Locks held by other threads at
+    that moment stay locked in them, so callers running conversions in
+    several threads should only use a single process, see main.watch.
+    :param func: module level function
+    :param state: state passed to every call
+    :param items: items to call the function with
+    :param processes: maximum number of processes
+    :return: list of results
+    """
+    global _fork_state  # pylint: disable=W0603
+
+    items = list(items)
+    processes = min(processes, len(items))
+
+    # Daemonic processes, such as the workers of a multiprocessing pool,
+    # can't start processes of their own
+    if processes < 2 or multiprocessing.current_process().daemon:
+        return [func(state, item) for item in items]
+
+    # The processes are forked when the pool is created, so the state only
+    # has to be set until then. Logging is locked meanwhile, so no other
+    # thread is in the middle of writing a record when they are forked.
+    with _fork_lock:
+        _fork_state = state
+        _acquire_logging()
+        try:
+            pool = multiprocessing.Pool(processes)
+        finally:
+            _release_logging()
+            _fork_state = None
+
+    try:
+        return pool.map(_fork_call, [(func, item) for item in items],
+                        chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _acquire_logging():
+    """
+    Acquire the locks of the logging module and of the root handlers
+    """
+    logging._acquireLock()  # pylint: disable=W0212
+    for handler in logging.getLogger().handlers:
+        handler.acquire()
+
+
+def _release_logging():
+    """
+    Release the locks acquired by _acquire_logging
+    """
+    for handler in reversed(logging.getLogger().handlers):
+        handler.release()
+    logging._releaseLock()  # pylint: disable=W0212
@@ -1,5 +1,7 @@
 from setuptools import setup, find_packages
 
+from rdfconv import __version__
+
 try:
     import pypandoc
     long_desc = pypandoc.convert('README.md', 'rst')
@@ -10,7 +12,7 @@ except ImportError:
 
 setup(
     name='rdf-to-html',
-    version='1.1.0',
+    version=__version__,
     description='RDF to HTML converter',
     license='EUPL v1.1',
     long_description=long_desc,
@@ -23,15 +25,19 @@ setup(
     keywords=['Open Data', 'Linked Open Data', 'RDF', 'DCAT'],
     author='Kim Nilsson',
     author_email='kim.nilsson@dohi.se',
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests']),
     include_package_data=True,
     install_requires=[
         'rdflib>=4.2.1',
-        'django>=1.8.6',
         'requests>=2.8.1',
         'pyinotify>=0.9.6',
         'ckanapi',
     ],
+    extras_require={
+        'django': ['django>=1.8.6'],
+        'jsonld': ['rdflib-jsonld'],
+        'brotli': ['brotli'],
+    },
     entry_points={
         'console_scripts': [
             'rdf-to-html=rdfconv.main:main',
@@ -0,0 +1,40 @@
+"""
+Tests of rdfconv.cache
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdfconv.cache import _write_entry
+
+
+def dump_half(data, file_obj):
+    """
+    Write part of an entry and fail
+    """
+    file_obj.write('{"half": ')
+    raise TypeError('%r is not JSON serializable' % data)
+
+
+class TestWriteEntry(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'entry.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_written(self):
+        self.assertTrue(_write_entry(self.folder, self.path, {'a': 1}))
+        self.assertEqual(os.listdir(self.folder), ['entry.json'])
+
+    def test_failed_dump(self):
+        self.assertFalse(_write_entry(self.folder, self.path, object(),
+                                      dump_half))
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Tests of rdfconv.compress and of how rdfconv.utils.output_file replaces
+and reports the files it changed
+"""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from rdfconv.compress import GZIP, compress_files, get_compressed_path
+from rdfconv.utils import output_file
+
+
+class TestCompressFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'catalog.html.en')
+        self.write('<html></html>')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, content):
+        changed = []
+        with output_file(self.path, True, changed=changed) as page:
+            page.write(content)
+        return changed
+
+    def read_variant(self):
+        gzip_file = gzip.open(get_compressed_path(self.path, GZIP))
+        try:
+            return gzip_file.read()
+        finally:
+            gzip_file.close()
+
+    def test_output_file_reports_changes(self):
+        self.assertEqual(self.write('<html></html>'), [])
+        self.assertEqual(self.write('<html>new</html>'), [self.path])
+
+    def test_output_file_failure(self):
+        with self.assertRaises(ValueError):
+            with output_file(self.path) as page:
+                page.write('<html>half')
+                raise ValueError()
+        with open(self.path) as file_obj:
+            self.assertEqual(file_obj.read(), '<html></html>')
+        self.assertEqual(os.listdir(self.folder), ['catalog.html.en'])
+
+    def test_missing_variant(self):
+        variants = compress_files([self.path], [GZIP], changed=[])
+        self.assertEqual(variants, [get_compressed_path(self.path, GZIP)])
+        self.assertEqual(self.read_variant(), '<html></html>')
+
+    def test_unchanged_file(self):
+        compress_files([self.path], [GZIP])
+        variant = get_compressed_path(self.path, GZIP)
+        with open(variant, 'wb') as file_obj:
+            file_obj.write('left alone')
+        os.utime(variant, (os.path.getmtime(self.path) + 1,) * 2)
+
+        compress_files([self.path], [GZIP], changed=self.write(
+            '<html></html>'))
+        with open(variant, 'rb') as file_obj:
+            self.assertEqual(file_obj.read(), 'left alone')
+
+    def test_changed_file(self):
+        compress_files([self.path], [GZIP])
+        variant = get_compressed_path(self.path, GZIP)
+        os.utime(variant, (os.path.getmtime(self.path) + 1,) * 2)
+
+        compress_files([self.path], [GZIP], changed=self.write(
+            '<html>new</html>'))
+        self.assertEqual(self.read_variant(), '<html>new</html>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+"""
+Tests of the pages written by rdfconv.html. The nodes and links of the
+pages are compared with the triples parsed by rdflib, and pages rendered
+with the fragment cache with pages rendered without it.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+import rdflib
+from rdflib.term import URIRef
+
+from rdfconv.cache import FragmentCache
+from rdfconv.converter import RDFtoHTMLConverter
+from rdfconv.predicate import PredicateResolver
+
+DATASETS = 7
+
+ID_REGEX = re.compile(r'id="([0-9a-f]{32})"')
+LINK_REGEX = re.compile(r'href="([^"#]*)#([0-9a-f]{32})"')
+
+
+def get_catalog():
+    """
+    Get N-Triples of a catalog of datasets sharing a publisher, each with
+    a blank node distribution
+    """
+    lines = [
+        '<http://ex.org/cat> <http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+        'type> <http://www.w3.org/ns/dcat#Catalog> .',
+        '<http://ex.org/cat> <http://purl.org/dc/terms/title> "Cat"@en .',
+        '<http://ex.org/pub> <http://xmlns.com/foaf/0.1/name> "Pub"@en .',
+    ]
+    for i in range(DATASETS):
+        lines += [
+            '<http://ex.org/cat> <http://www.w3.org/ns/dcat#dataset> '
+            '<http://ex.org/d%d> .' % i,
+            '<http://ex.org/d%d> <http://www.w3.org/1999/02/22-rdf-syntax-'
+            'ns#type> <http://www.w3.org/ns/dcat#Dataset> .' % i,
+            '<http://ex.org/d%d> <http://purl.org/dc/terms/title> '
+            '"Dataset %d"@en .' % (i, i),
+            '<http://ex.org/d%d> <http://purl.org/dc/terms/publisher> '
+            '<http://ex.org/pub> .' % i,
+            '<http://ex.org/d%d> <http://www.w3.org/ns/dcat#distribution> '
+            '_:dist%d .' % (i, i),
+            '_:dist%d <http://www.w3.org/ns/dcat#accessURL> '
+            '<http://ex.org/d%d.csv> .' % (i, i),
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def get_fragment(rdf_id):
+    return hashlib.md5(rdf_id).hexdigest()
+
+
+class TestPagedLinks(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.folder, 'catalog.nt')
+        with open(self.input_file, 'wb') as file_obj:
+            file_obj.write(get_catalog())
+
+        self.graph = rdflib.Graph()
+        self.graph.parse(self.input_file, format='nt')
+
+        self.output = os.path.join(self.folder, 'out')
+        os.mkdir(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def convert(self, page_size):
+        rdf_conv = RDFtoHTMLConverter(
+            ['en'], pred_res=PredicateResolver(offline=True))
+        rdf_conv.page_size = page_size
+        rdf_conv.stable_output = True
+        try:
+            rdf_conv.load_file(self.input_file)
+            rdf_conv.output_html(self.output)
+        finally:
+            rdf_conv.close()
+
+        # Node -> page, and the links of every page
+        pages = {}
+        links = {}
+        for name in os.listdir(self.output):
+            if not name.endswith('.html.en'):
+                continue
+            with open(os.path.join(self.output, name)) as file_obj:
+                content = file_obj.read()
+            for fragment in ID_REGEX.findall(content):
+                self.assertNotIn(fragment, pages)
+                pages[fragment] = name
+            links[name] = LINK_REGEX.findall(content)
+        return pages, links
+
+    def check_links(self, page_size):
+        pages, links = self.convert(page_size)
+
+        # Every subject is a node, on exactly one page
+        subjects = set(self.graph.subjects())
+        self.assertEqual(len(pages), len(subjects))
+        for subj in subjects:
+            if isinstance(subj, URIRef):
+                self.assertIn(get_fragment(subj.encode('utf-8')), pages)
+
+        # Every link to a node leads to the page it is on
+        for name, page_links in links.iteritems():
+            for link_file, fragment in page_links:
+                self.assertIn(fragment, pages)
+                target = link_file + '.en' if link_file else name
+                self.assertEqual(target, pages[fragment])
+
+        # Every node links to the local objects of its triples
+        for subj, _, obj in self.graph:
+            if isinstance(subj, URIRef) and isinstance(obj, URIRef) and \
+                    obj in subjects:
+                name = pages[get_fragment(subj.encode('utf-8'))]
+                fragments = [fragment for _, fragment in links[name]]
+                self.assertIn(get_fragment(obj.encode('utf-8')), fragments)
+        return pages
+
+    def test_single_page(self):
+        pages = self.check_links(0)
+        self.assertEqual(set(pages.itervalues()), set(['catalog.html.en']))
+
+    def test_pages(self):
+        pages = self.check_links(3)
+        self.assertGreater(len(set(pages.itervalues())), 1)
+
+
+class TestFragmentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.folder, 'catalog.nt')
+        self.vocabulary_dir = os.path.join(self.folder, 'vocabularies')
+        os.mkdir(self.vocabulary_dir)
+        self.fragment_cache = FragmentCache(
+            os.path.join(self.folder, 'fragments'))
+
+        self.write_catalog('Pub')
+        self.write_vocabulary('Title')
+
+        # Fill the cache
+        self.convert('cached', self.fragment_cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_catalog(self, publisher):
+        with open(self.input_file, 'wb') as file_obj:
+            file_obj.write(get_catalog().replace('"Pub"', '"%s"' % publisher))
+
+    def write_vocabulary(self, label):
+        labels = {'http://purl.org/dc/terms/title': {'en': label}}
+        path = os.path.join(self.vocabulary_dir, 'dcterms.json')
+        with open(path, 'w') as file_obj:
+            json.dump({'url': 'http://purl.org/dc/terms', 'labels': labels},
+                      file_obj)
+
+    def convert(self, name, fragment_cache=None):
+        """
+        Convert the catalog to a folder
+        :return: content of the page
+        """
+        pred_res = PredicateResolver(offline=True,
+                                     vocabulary_dir=self.vocabulary_dir)
+        rdf_conv = RDFtoHTMLConverter(['en'], pred_res=pred_res)
+        rdf_conv.fragment_cache = fragment_cache
+        rdf_conv.stable_output = True
+        output = os.path.join(self.folder, name)
+        try:
+            rdf_conv.load_file(self.input_file)
+            rdf_conv.output_html(output)
+        finally:
+            rdf_conv.close()
+        with open(os.path.join(output, 'catalog.html.en')) as file_obj:
+            return file_obj.read()
+
+    def check_cached(self, text):
+        page = self.convert('cached', self.fragment_cache)
+        self.assertIn(text, page)
+        self.assertEqual(page, self.convert('uncached'))
+
+    def test_linked_title(self):
+        self.write_catalog('Publisher')
+        self.check_cached('Publisher')
+
+    def test_predicate_label(self):
+        self.write_vocabulary('Name')
+        self.check_cached('Name')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of rdfconv.ingest, comparing the triples read by the converter with
+those parsed by rdflib
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import rdflib
+from rdflib.compare import isomorphic
+from rdflib.term import URIRef, BNode
+
+from rdfconv.ingest import N_TRIPLES, TURTLE, RDF_XML, JSON_LD, \
+    FormatError, TripleSink, guess_format, parse_file, parse_ntriples
+from rdfconv.store import ObjectStore, StoreSink
+
+DCAT = 'http://www.w3.org/ns/dcat#'
+DCT = 'http://purl.org/dc/terms/'
+LABEL = 'http://www.w3.org/2000/01/rdf-schema#label'
+
+NTRIPLES = r'''# A catalog
+<http://ex.org/d1> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/ns/dcat#Dataset> .
+<http://ex.org/d1> <http://purl.org/dc/terms/title> "Datamängd"@sv .
+<http://ex.org/d1> <http://purl.org/dc/terms/title> "Dataset \"one\""@en-GB .
+<http://ex.org/d1> <http://purl.org/dc/terms/description> "Two\nlines\twith a \\ and \U0001F600" .
+<http://ex.org/d1> <http://purl.org/dc/terms/issued> "2016-01-01"^^<http://www.w3.org/2001/XMLSchema#date> .
+
+<http://ex.org/d1> <http://www.w3.org/ns/dcat#distribution> _:dist . # trailing comment
+_:dist <http://purl.org/dc/terms/title> "CSV" .
+_:dist <http://purl.org/dc/terms/title> "CSV" .
+_:dist <http://www.w3.org/ns/dcat#accessURL> <http://ex.org/d1.csv> .
+'''
+
+
+def get_graph(sink):
+    """
+    Build an rdflib Graph of the triples of a TripleSink
+    """
+    graph = rdflib.Graph()
+    for subj, attributes in sink.subjects.iteritems():
+        for pred, objs in attributes.iteritems():
+            for obj in objs:
+                graph.add((subj, URIRef(pred), obj))
+    return graph
+
+
+def get_catalog(labels):
+    """
+    Get N-Triples of a dataset with two distributions, whose formats are
+    blank nodes telling them apart
+    :param labels: blank node labels of the distributions
+    """
+    first, second = labels
+    triples = [
+        '<http://ex.org/d1> <%sdistribution> _:%s .' % (DCAT, first),
+        '<http://ex.org/d1> <%sdistribution> _:%s .' % (DCAT, second),
+        '_:%s <%sformat> _:f%s .' % (first, DCT, first),
+        '_:%s <%sformat> _:f%s .' % (second, DCT, second),
+        '_:f%s <%s> "CSV" .' % (first, LABEL),
+        '_:f%s <%s> "XML" .' % (second, LABEL),
+    ]
+    return '\n'.join(triples) + '\n'
+
+
+def get_distribution(sink, label):
+    """
+    Get the distribution of a catalog from get_catalog whose format has
+    a label
+    """
+    for subj, attributes in sink.subjects.iteritems():
+        for fmt in attributes.get(DCT + 'format', []):
+            if sink.subjects[fmt][LABEL][0].toPython() == label:
+                return subj
+
+
+class IngestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as file_obj:
+            file_obj.write(content)
+        return path
+
+
+class TestParseNtriples(IngestTestCase):
+
+    def test_same_triples_as_rdflib(self):
+        path = self.write('catalog.nt', NTRIPLES)
+        sink = parse_file(path)
+
+        expected = rdflib.Graph()
+        expected.parse(path, format='nt')
+        self.assertTrue(isomorphic(get_graph(sink), expected))
+
+    def test_languages(self):
+        sink = parse_file(self.write('catalog.nt', NTRIPLES))
+        self.assertEqual(sink.languages, set(['sv', 'en-GB']))
+
+    def test_invalid_line(self):
+        sink = TripleSink()
+        lines = NTRIPLES.splitlines()
+        lines.insert(3, '<http://ex.org/d1> "not a predicate" "x" .')
+        with self.assertRaises(FormatError):
+            parse_ntriples(lines, sink)
+
+
+class TestGuessFormat(IngestTestCase):
+
+    def test_extension(self):
+        self.assertEqual(guess_format('catalog.ttl'), TURTLE)
+        self.assertEqual(guess_format('catalog.NT'), N_TRIPLES)
+
+    def test_ntriples_after_comments(self):
+        path = self.write('catalog.data', '\n# Exported\n#\n\n' + NTRIPLES)
+        self.assertEqual(guess_format(path), N_TRIPLES)
+
+    def test_turtle_after_comments(self):
+        path = self.write('catalog.data',
+                          '# Exported\n@prefix dcat: <%s> .\n' % DCAT)
+        self.assertEqual(guess_format(path), TURTLE)
+
+    def test_json_ld(self):
+        path = self.write('catalog.data', '  [{"@id": "http://ex.org/d1"}]')
+        self.assertEqual(guess_format(path), JSON_LD)
+
+    def test_rdf_xml(self):
+        path = self.write('catalog.data',
+                          '<?xml version="1.0"?>\n<rdf:RDF></rdf:RDF>\n')
+        self.assertEqual(guess_format(path), RDF_XML)
+
+
+class TestRenameBnodes(IngestTestCase):
+
+    def parse(self, labels):
+        path = self.write('catalog.nt', get_catalog(labels))
+        sink = parse_file(path)
+        sink.rename_bnodes()
+        return path, sink
+
+    def test_same_triples_as_rdflib(self):
+        path = self.write('catalog.nt', NTRIPLES)
+        sink = parse_file(path)
+        sink.rename_bnodes()
+
+        expected = rdflib.Graph()
+        expected.parse(path, format='nt')
+        self.assertTrue(isomorphic(get_graph(sink), expected))
+
+    def test_independent_of_labels(self):
+        _, sink = self.parse(('a', 'b'))
+        _, swapped = self.parse(('b', 'a'))
+        self.assertEqual(set(sink.subjects), set(swapped.subjects))
+        self.assertEqual(get_distribution(sink, 'CSV'),
+                         get_distribution(swapped, 'CSV'))
+
+    def test_nested_bnodes(self):
+        # The distributions only differ by the labels of their formats
+        _, sink = self.parse(('a', 'b'))
+        names = set(subj for subj in sink.subjects
+                    if isinstance(subj, BNode))
+        self.assertEqual(len(names), 4)
+        self.assertNotEqual(get_distribution(sink, 'CSV'),
+                            get_distribution(sink, 'XML'))
+
+    def test_same_names_in_store(self):
+        path, sink = self.parse(('a', 'b'))
+
+        store = ObjectStore()
+        try:
+            store_sink = parse_file(path, sink=StoreSink(store))
+            store.build(store_sink.namespace_manager)
+            self.assertEqual(sorted(store),
+                             sorted(subj.toPython() for subj in sink.subjects))
+        finally:
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Tests of rdfconv.predicate
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from rdfconv import predicate
+from rdfconv.cache import CacheEntry, VocabularyCache, DEFAULT_TTL, \
+    DEFAULT_NEGATIVE_TTL
+from rdfconv.predicate import PredicateResolver, CircuitBreaker
+
+DCAT = 'http://www.w3.org/ns/dcat'
+
+VOCABULARY = 'http://ex.org/vocab'
+TERM = VOCABULARY + '#term'
+
+
+class Response(object):
+    """
+    Response returned by the stubbed requests.get
+    """
+
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class ResolverTestCase(unittest.TestCase):
+    """
+    Test case with requests.get replaced by a stub answering with the
+    queued responses and recording the requests
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = VocabularyCache(self.folder)
+        self.responses = []
+        self.requests = []
+        self._get = predicate.requests.get
+        predicate.requests.get = self.get
+
+    def tearDown(self):
+        predicate.requests.get = self._get
+        shutil.rmtree(self.folder)
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append((url, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def put(self, age, labels=None, etag=None, failed=False):
+        """
+        Cache the vocabulary, fetched some seconds ago
+        """
+        self.cache.put(CacheEntry(VOCABULARY, labels or {},
+                                  fetched=time.time() - age, etag=etag,
+                                  failed=failed))
+
+
+class TestCachedVocabularies(ResolverTestCase):
+
+    def test_fresh_entry(self):
+        self.put(0, {TERM: {'en': 'Term'}})
+        resolver = PredicateResolver(self.cache)
+        self.assertEqual(resolver.resolve(TERM, 'en'), 'Term')
+        self.assertEqual(self.requests, [])
+
+    def test_not_modified(self):
+        self.put(DEFAULT_TTL + 1, {TERM: {'en': 'Term'}}, etag='"v1"')
+        self.responses.append(Response(304))
+        resolver = PredicateResolver(self.cache)
+        self.assertEqual(resolver.resolve(TERM, 'en'), 'Term')
+
+        _, headers = self.requests[0]
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertTrue(self.cache.is_fresh(self.cache.get(VOCABULARY)))
+
+    def test_stale_entry_on_failure(self):
+        self.put(DEFAULT_TTL + 1, {TERM: {'en': 'Term'}})
+        self.responses.append(requests.ConnectionError('unreachable'))
+        resolver = PredicateResolver(self.cache)
+        self.assertEqual(resolver.resolve(TERM, 'en'), 'Term')
+        self.assertEqual(len(self.requests), 1)
+
+    def test_negative_entry(self):
+        self.put(0, failed=True)
+        resolver = PredicateResolver(self.cache)
+        self.assertIsNone(resolver.resolve(TERM, 'en'))
+        self.assertEqual(self.requests, [])
+
+    def test_negative_entry_expires(self):
+        self.put(DEFAULT_NEGATIVE_TTL + 1, failed=True)
+        self.responses.append(Response(404))
+        resolver = PredicateResolver(self.cache)
+        self.assertIsNone(resolver.resolve(TERM, 'en'))
+        self.assertEqual(len(self.requests), 1)
+
+        # Failed again, so not retried until the new entry expires
+        self.assertIsNone(resolver.resolve(TERM, 'en'))
+        self.assertIsNone(PredicateResolver(self.cache).resolve(TERM, 'en'))
+        self.assertEqual(len(self.requests), 1)
+
+
+class TestCircuitBreaker(ResolverTestCase):
+
+    def test_threshold(self):
+        breaker = CircuitBreaker(threshold=3)
+        for _ in range(2):
+            breaker.record_failure('ex.org')
+            self.assertTrue(breaker.allow('ex.org'))
+        breaker.record_failure('ex.org')
+        self.assertFalse(breaker.allow('ex.org'))
+        self.assertTrue(breaker.allow('ex.com'))
+
+    def test_success_resets(self):
+        breaker = CircuitBreaker(threshold=2)
+        breaker.record_failure('ex.org')
+        breaker.record_success('ex.org')
+        breaker.record_failure('ex.org')
+        self.assertTrue(breaker.allow('ex.org'))
+
+    def test_host_skipped(self):
+        self.responses.append(Response(503))
+        resolver = PredicateResolver()
+        self.assertIsNone(resolver.resolve(TERM, 'en'))
+        self.assertIsNone(resolver.resolve('http://ex.org/other#term', 'en'))
+        self.assertEqual(len(self.requests), 1)
+
+
+class TestOfflineGeneration(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.write_snapshot('Dataset')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_snapshot(self, label):
+        labels = {DCAT + '#Dataset': {'en': label}}
+        with open(os.path.join(self.folder, 'dcat.json'), 'w') as file_obj:
+            json.dump({'url': DCAT, 'labels': labels}, file_obj)
+
+    def get_generation(self):
+        return PredicateResolver(offline=True,
+                                 vocabulary_dir=self.folder).get_generation()
+
+    def test_same_snapshots(self):
+        self.assertEqual(self.get_generation(), self.get_generation())
+
+    def test_edited_snapshot(self):
+        generation = self.get_generation()
+        self.write_snapshot('Data set')
+        self.assertNotEqual(self.get_generation(), generation)
+
+    def test_bundled_snapshots(self):
+        self.assertNotEqual(PredicateResolver(offline=True).get_generation(),
+                            self.get_generation())
+
+
+if __name__ == '__main__':
+    unittest.main()
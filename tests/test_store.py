@@ -0,0 +1,75 @@
+"""
+Tests of rdfconv.store, comparing the disk-backed store with the objects
+kept in memory by the converter
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdfconv.converter import RDFtoHTMLConverter
+from rdfconv.predicate import PredicateResolver
+
+TITLE = 'http://purl.org/dc/terms/title'
+TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+DATASET = 'http://www.w3.org/ns/dcat#Dataset'
+
+
+def get_catalog():
+    """
+    Get N-Triples of datasets sharing titles, some of them blank nodes
+    """
+    lines = []
+    for i, subj in enumerate(['<http://ex.org/b>', '_:x', '<http://ex.org/a>',
+                              '_:y', '<http://ex.org/c>']):
+        lines.append('%s <%s> <%s> .' % (subj, TYPE, DATASET))
+        lines.append('%s <%s> "Dataset %d"@en .' % (subj, TITLE, i % 2))
+    lines.append('_:y <%s> "Other"@sv .' % TITLE)
+    return '\n'.join(lines) + '\n'
+
+
+class TestObjectStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.folder, 'catalog.nt')
+        with open(self.input_file, 'wb') as file_obj:
+            file_obj.write(get_catalog())
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load(self, disk_store):
+        rdf_conv = RDFtoHTMLConverter(
+            ['en', 'sv'], pred_res=PredicateResolver(offline=True))
+        rdf_conv.disk_store = disk_store
+        rdf_conv.load_file(self.input_file)
+        return rdf_conv
+
+    def test_same_order(self):
+        memory = self.load(False)
+        disk = self.load(True)
+        try:
+            self.assertEqual(list(disk.objects), list(memory.objects))
+        finally:
+            disk.close()
+
+    def test_contains(self):
+        memory = self.load(False)
+        disk = self.load(True)
+        try:
+            for rdf_id in memory.objects:
+                self.assertIn(rdf_id, disk.objects)
+            self.assertNotIn(u'http://ex.org/missing', disk.objects)
+        finally:
+            disk.close()
+
+    def test_close_removes_database(self):
+        disk = self.load(True)
+        path = disk.objects.path
+        disk.close()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()